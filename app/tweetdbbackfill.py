@@ -0,0 +1,88 @@
+#!/usr/bin/python
+
+import tweetdb.tweetdb as tdb
+import tweetdb.backfill as tdbb
+import tweetdb.partition as tdbp
+import tweepy
+import urllib3
+import certifi
+import logging
+import argparse
+import sys
+from datetime import datetime as dt
+
+
+def main():
+    # command line option parsing stuff
+    parser = argparse.ArgumentParser(description="Backfill the timelines " +
+                                     "of a list of Twitter users.")
+    parser.add_argument("-v", "--verbose", default=False, action="store_true",
+                        dest="verbose",
+                        help="log to screen as well as logfile")
+
+    parser.add_argument("parmfile", type=str, help='YAML parameter file')
+    parser.add_argument("userfile", type=str,
+                        help='file listing one Twitter user id per line')
+
+    args = parser.parse_args()
+
+    # parse YAML parmfile
+    parmdata = tdb.read_parmdata(args.parmfile)
+    settings = parmdata['settings']['backfill']
+
+    # set up the logger
+    logFormatter = logging.Formatter("%(asctime)s [%(filename)-5.5s] "
+                                     "[%(levelname)-5.5s] [%(threadName)-5s] "
+                                     "%(message)s")
+    rootLogger = logging.getLogger('__name__')
+    rootLogger.setLevel('INFO')
+
+    if parmdata['files']['log_file'] is not None:
+        fileHandler = logging.FileHandler(parmdata['files']['log_file'],
+                                          mode='a')
+        fileHandler.setFormatter(logFormatter)
+        rootLogger.addHandler(fileHandler)
+
+    if args.verbose:
+        consoleHandler = logging.StreamHandler(sys.stdout)
+        consoleHandler.setFormatter(logFormatter)
+        rootLogger.addHandler(consoleHandler)
+
+    with open(args.userfile, 'r') as f:
+        userids = [int(line) for line in f if line.strip()]
+    rootLogger.info('Backfilling %d users.' % len(userids))
+
+    rootLogger.info('Authenticating to Twitter.')
+    api = tweepy.API(tdb.get_oauth(parmdata))
+    rootLogger.info('Connecting to database.')
+    sessions = tdbp.PartitionedSessions(parmdata, tdb.get_sql_session)
+
+    get_images = parmdata['settings']['get_images']
+    image_path = parmdata['settings']['image_storage']['path']
+    https = urllib3.PoolManager(cert_reqs="CERT_REQUIRED",
+                                ca_certs=certifi.where())
+
+    def write_page(page):
+        # a page can straddle partitions, so write it out period by period
+        bysession = {}
+        for tweet in page:
+            session = sessions.get(tweet.created_at)
+            bysession.setdefault(session, []).append(tweet)
+        for session, tweets in bysession.items():
+            tdb.add_tweets(tweets, session, get_images, image_path, https)
+
+    def write_user(user):
+        tdb.add_user(user, sessions.get(dt.utcnow()))
+
+    scheduler = tdbb.BackfillScheduler(
+        api, write_page, tdbb.BackfillCheckpoint(settings['checkpoint']),
+        num_fetchers=settings['num_fetchers'],
+        timeline_requests=settings['timeline_requests'],
+        user_requests=settings['user_requests'],
+        window=settings['window'],
+        write_user=write_user)
+    scheduler.run(userids)
+    sessions.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+
+import argparse
+import subprocess
+import sys
+import time
+
+# modules which only the ingest side should ever need
+HEAVY = ['tweepy', 'urllib3', 'certifi', 'requests']
+
+MODULES = ['tweetdb.models', 'tweetdb.database', 'tweetdb.analysis',
+           'tweetdb.tweetdb']
+
+PROBE = ("import sys, %s; "
+         "print(','.join(m for m in %r if m in sys.modules))")
+
+
+def time_import(module, repeat):
+    # best-of-N wall time for a fresh interpreter to import the module;
+    # returns (None, error) if the import fails, e.g. because the ingest
+    # dependencies aren't installed
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        try:
+            loaded = subprocess.check_output([sys.executable, '-c',
+                                              PROBE % (module, HEAVY)],
+                                             stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            lines = e.output.strip().splitlines()
+            return None, lines[-1] if lines else 'exit status %d' % \
+                e.returncode
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, loaded.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the import " +
+                                     "cost of the tweetdb modules.")
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help="interpreter launches per module")
+    args = parser.parse_args()
+
+    baseline, loaded = time_import('sys', args.repeat)
+    print('%-20s %10s  %s' % ('module', 'ms', 'ingest deps loaded'))
+    for module in MODULES:
+        elapsed, loaded = time_import(module, args.repeat)
+        if elapsed is None:
+            print('%-20s %10s  import failed: %s' % (module, '-', loaded))
+        else:
+            print('%-20s %10.1f  %s' % (module, 1000 * (elapsed - baseline),
+                                        loaded or '-'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+
+import tweetdb.database as tdb
+import tweetdb.migrate as tdbm
+import tweetdb.partition as tdbp
+import tweetdb.compact as tdbc
+import logging
+import argparse
+import sys
+import os
+from datetime import datetime as dt
+
+
+def encode(parmdata, args):
+    engine = tdb.get_sql_engine(parmdata)
+    tdbm.encode_columns(engine, chunksize=args.chunksize)
+
+
+def dates(parmdata, args):
+    engine = tdb.get_sql_engine(parmdata)
+    tdbm.add_child_dates(engine, chunksize=args.chunksize)
+
+
+def partitions(parmdata, args):
+    engine = tdb.get_sql_engine(parmdata)
+    tdbp.create_partitions(parmdata, engine, args.start, args.stop)
+
+
+def retire(parmdata, args):
+    settings = tdbp.partition_settings(parmdata)
+    if args.before is not None:
+        before = args.before
+    else:
+        keep = args.keep if args.keep is not None else settings['keep']
+        before = tdbp.retention_cutoff(dt.utcnow(),
+                                       settings['period'].lower(), keep)
+    engine = tdb.get_sql_engine(parmdata)
+    tdbp.retire_partitions(parmdata, engine, before, archive=args.archive)
+
+
+def compact(parmdata, args):
+    tdbc.Compactor(parmdata, tdb.get_sql_session).run()
+
+
+def replay(parmdata, args):
+    sessions = tdbp.PartitionedSessions(parmdata, tdb.get_sql_session)
+    for directory in args.directories:
+        day = dt.strptime(os.path.basename(os.path.normpath(directory)),
+                          tdbc.DAY_FORMAT)
+        tdbc.replay_archive(directory, sessions.get(day))
+    sessions.close()
+
+
+def date_arg(text):
+    return dt.strptime(text, '%Y-%m-%d')
+
+
+def main():
+    # command line option parsing stuff
+    parser = argparse.ArgumentParser(description="Maintenance tasks for " +
+                                     "a TweetDB database.")
+    parser.add_argument("-v", "--verbose", default=False, action="store_true",
+                        dest="verbose",
+                        help="log to screen as well as logfile")
+    parser.add_argument("parmfile", type=str, help='YAML parameter file')
+    subparsers = parser.add_subparsers(title="tasks")
+
+    encode_parser = subparsers.add_parser(
+        "encode", help="dictionary encode the lang, source, place and "
+        "timezone columns of an existing database (stop ingest first)")
+    encode_parser.add_argument("--chunksize", type=int, default=50000,
+                               help="rows converted per transaction")
+    encode_parser.set_defaults(task=encode)
+
+    dates_parser = subparsers.add_parser(
+        "dates", help="copy tweet dates onto the child tables of an "
+        "existing database")
+    dates_parser.add_argument("--chunksize", type=int, default=50000,
+                              help="rows converted per transaction")
+    dates_parser.set_defaults(task=dates)
+
+    partitions_parser = subparsers.add_parser(
+        "partitions", help="create the partitions for a range of dates")
+    partitions_parser.add_argument("start", type=date_arg,
+                                   help="first date (YYYY-MM-DD)")
+    partitions_parser.add_argument("stop", type=date_arg,
+                                   help="last date (YYYY-MM-DD)")
+    partitions_parser.set_defaults(task=partitions)
+
+    retire_parser = subparsers.add_parser(
+        "retire", help="drop (or archive) old partitions")
+    retire_parser.add_argument("--before", type=date_arg, default=None,
+                               help="retire partitions ending by this date "
+                               "(YYYY-MM-DD)")
+    retire_parser.add_argument("--keep", type=int, default=None,
+                               help="number of periods to keep (defaults "
+                               "to database: partition: keep)")
+    retire_parser.add_argument("--archive", default=False,
+                               action="store_true",
+                               help="archive partitions instead of "
+                               "dropping them")
+    retire_parser.set_defaults(task=retire)
+
+    compact_parser = subparsers.add_parser(
+        "compact", help="summarize, archive and delete raw rows older "
+        "than settings: compaction: age_days")
+    compact_parser.set_defaults(task=compact)
+
+    replay_parser = subparsers.add_parser(
+        "replay", help="load archived days written by compact back into "
+        "the database")
+    replay_parser.add_argument("directories", nargs='+',
+                               help="archive directories (one per day)")
+    replay_parser.set_defaults(task=replay)
+
+    args = parser.parse_args()
+
+    # parse YAML parmfile
+    parmdata = tdb.read_parmdata(args.parmfile)
+
+    # set up the logger
+    logFormatter = logging.Formatter("%(asctime)s [%(filename)-5.5s] "
+                                     "[%(levelname)-5.5s] %(message)s")
+    rootLogger = logging.getLogger('__name__')
+    rootLogger.setLevel('INFO')
+
+    if parmdata['files']['log_file'] is not None:
+        fileHandler = logging.FileHandler(parmdata['files']['log_file'],
+                                          mode='a')
+        fileHandler.setFormatter(logFormatter)
+        rootLogger.addHandler(fileHandler)
+
+    if args.verbose:
+        consoleHandler = logging.StreamHandler(sys.stdout)
+        consoleHandler.setFormatter(logFormatter)
+        rootLogger.addHandler(consoleHandler)
+
+    args.task(parmdata, args)
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,26 @@ import time
 from multiprocessing import cpu_count, Queue
 
 
+def run_pipeline(auth, parmdata, rootLogger):
+    '''
+    Stream with the single process pipeline: reader threads, image
+    downloaders and one batching database writer.
+    '''
+    pipeline = tdb.single_process_pipeline(auth, parmdata)
+    pipeline.start()
+    while True:
+        try:
+            time.sleep(1)
+            if not pipeline.running():
+                rootLogger.error('Pipeline stopped, shutting down.')
+                return
+        except KeyboardInterrupt:
+            rootLogger.info('Keyboard interrupt detected.  Depleting queue ' +
+                            'and preparing to shutdown.')
+            pipeline.close()
+            return
+
+
 def main():
     # command line option parsing stuff
     parser = argparse.ArgumentParser(description="Capture and store" +
@@ -27,6 +47,11 @@ def main():
     parser.add_argument("-v", "--verbose", default=False, action="store_true",
                         dest="verbose",
                         help="log to screen as well as logfile")
+    parser.add_argument("-e", "--engine", choices=["process", "thread"],
+                        default=None, dest="engine",
+                        help="run producers and consumers as processes, or "
+                        "as threads of a single process (defaults to "
+                        "settings: engine)")
 
     parser.add_argument("parmfile", type=str, help='YAML parameter file')
 
@@ -70,7 +95,10 @@ def main():
         return
 
     if args.createflag:
-        tdb.create_tables(engine)
+        tdb.create_tables(engine, parmdata)
+
+    # don't carry the parent's pooled connections into forked consumers
+    engine.dispose()
   
     # spin up the tweet handlers
     if parmdata['settings']['num_consumers'] > cpu_count():
@@ -86,6 +114,12 @@ def main():
                         'Twitter API limits you to 2.')
         parmdata['settings']['num_producers'] = 2
 
+    if args.engine is None:
+        args.engine = parmdata['settings'].get('engine', 'process')
+    if args.engine == 'thread':
+        run_pipeline(auth, parmdata, rootLogger)
+        return
+
     if parmdata['database']['db_type'].upper() == "SQLITE":
         rootLogger.info('Requested %d threads '
                         % parmdata['settings']['num_consumers'] +
@@ -95,7 +129,7 @@ def main():
 
     consumers = []
     for i in range(parmdata['settings']['num_consumers']):
-        consumers.append(tdb.tweet_consumer(queue, engine, parmdata,
+        consumers.append(tdb.tweet_consumer(queue, parmdata,
                                             name="consumer_%d" % i))
         consumers[i].start()
 
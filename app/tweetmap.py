@@ -3,7 +3,6 @@
 from flask import Flask
 from flask import render_template, request
 from tweetdb import analysis as tdba
-from tweetdb import tweetdb as tdb
 import json
 from bson import json_util
 from bson.json_util import dumps
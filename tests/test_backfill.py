@@ -0,0 +1,108 @@
+'''
+Exercises BackfillScheduler against FakeTimelineAPI.  Run with
+
+  python -m unittest discover tests
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from tweetdb import backfill
+
+
+class FakeStatus(object):
+    def __init__(self, id):
+        self.id = id
+
+
+def timelines(users, ntweets):
+    # user u's tweets have ids u*10000+1 ... u*10000+ntweets
+    return dict((u, [FakeStatus(u * 10000 + i)
+                     for i in range(1, ntweets + 1)]) for u in users)
+
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'checkpoint.json')
+        self.written = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def scheduler(self, api, write_page=None, **kwargs):
+        return backfill.BackfillScheduler(
+            api, write_page or self.written.extend,
+            backfill.BackfillCheckpoint(self.path), **kwargs)
+
+    def ids(self, userid):
+        return sorted(set(t.id for t in self.written
+                          if t.id // 10000 == userid))
+
+    def test_rate_limit_backoff(self):
+        # the fake allows 5 calls per 0.2s window, far fewer than the
+        # scheduler's buckets would make, so it has to back off when told
+        api = backfill.FakeTimelineAPI(timelines([1, 2, 3], 1000),
+                                       requests=5, window=0.2)
+        scheduler = self.scheduler(api, num_fetchers=3, window=0.2)
+        scheduler.run([1, 2, 3])
+        self.assertTrue(api.n_limited > 0)
+        self.assertEqual(scheduler.errors, [])
+        for userid in [1, 2, 3]:
+            self.assertEqual(len(self.ids(userid)), 1000)
+
+    def test_resume_after_failed_write(self):
+        state = {'failed': False}
+
+        def write_page(page):
+            # the second page of user 2's timeline fails once
+            if page[0].id // 10000 == 2 and len(self.ids(2)) == 200 and \
+               not state['failed']:
+                state['failed'] = True
+                raise RuntimeError('database went away')
+            self.written.extend(page)
+
+        api = backfill.FakeTimelineAPI(timelines([1, 2], 450))
+        scheduler = self.scheduler(api, write_page, num_fetchers=2)
+        scheduler.run([1, 2])
+        self.assertEqual([userid for userid, e in scheduler.errors], [2])
+        self.assertEqual(len(self.ids(2)), 200)
+        # the checkpoint stops at the last page written
+        with open(self.path, 'r') as f:
+            progress = json.load(f)['2']
+        self.assertEqual(progress['max_id'], 2 * 10000 + 250)
+        self.assertEqual(progress['newest'], 2 * 10000 + 450)
+
+        scheduler = self.scheduler(backfill.FakeTimelineAPI(
+            timelines([1, 2], 450)), write_page, num_fetchers=2)
+        scheduler.run([1, 2])
+        self.assertEqual(scheduler.errors, [])
+        # user 2 picks up from max_id, user 1 only checks for new tweets
+        self.assertEqual(scheduler.n_pages, 2)
+        self.assertEqual(self.ids(2), [2 * 10000 + i
+                                       for i in range(1, 451)])
+        with open(self.path, 'r') as f:
+            progress = json.load(f)['2']
+        self.assertEqual(progress['since_id'], 2 * 10000 + 450)
+        self.assertEqual(progress['max_id'], None)
+
+    def test_incremental_walk(self):
+        tweets = timelines([1], 300)
+        self.scheduler(backfill.FakeTimelineAPI(tweets)).run([1])
+        self.assertEqual(len(self.ids(1)), 300)
+
+        # the next run only fetches what was tweeted since
+        tweets[1].extend(FakeStatus(10000 + i) for i in range(301, 311))
+        self.written = []
+        scheduler = self.scheduler(backfill.FakeTimelineAPI(tweets))
+        scheduler.run([1])
+        self.assertEqual(self.ids(1), [10000 + i for i in range(301, 311)])
+        self.assertEqual(scheduler.n_pages, 1)
+        with open(self.path, 'r') as f:
+            self.assertEqual(json.load(f)['1']['since_id'], 10000 + 310)
+
+
+if __name__ == '__main__':
+    unittest.main()
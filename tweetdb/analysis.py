@@ -7,8 +7,10 @@ AUTHOR_EMAIL = ""
 URL = "https://github.com/starkshift/tweetdb"
 LICENSE = "MIT"
 
-import tweetdb as tdb
-from tweetdb import User, Tweet, Hashtag, Geotag, Mention, URLData, Media
+import database as tdb
+import partition
+from models import User, Tweet, Hashtag, HashtagLexicon, Geotag, Mention, \
+    URLData, Media, LangLexicon
 import sqlalchemy as sa
 from datetime import datetime as dt
 from datetime import timedelta
@@ -22,52 +24,123 @@ class DatabaseInterrogator(object):
     def getTweets(self, start, stop=None, lang='en', limit=None):
         if stop is None:
             stop = dt.utcnow()
-            
-        thisQuery = self.session.query(Tweet).\
-                    filter(Tweet.date >= start).\
-                    filter(Tweet.date <= stop).\
-                    filter(sa.func.upper(Tweet.lang) == lang.upper())
-
-        if limit is not None:
-            return thisQuery.limit(limit).all()
-        else:
-            return thisQuery.all()
+        tweets = []
+        for _ in self.eachPartition(start, stop):
+            thisQuery = self.session.query(Tweet).\
+                        filter(Tweet.date >= start).\
+                        filter(Tweet.date <= stop).\
+                        filter(self.langFilter(lang))
+            if limit is not None:
+                thisQuery = thisQuery.limit(limit - len(tweets))
+            tweets.extend(thisQuery.all())
+            if limit is not None and len(tweets) >= limit:
+                break
+        return tweets
 
     def getGeotagLocations(self, start, stop=None, lang='en', limit=None):
         if stop is None:
             stop = dt.utcnow()
-
-        thisQuery = self.session.query(Geotag.latitude, Geotag.longitude, Tweet.date).\
-                    filter(Tweet.date >= start).\
-                    filter(Tweet.date <= stop).\
-                    filter(Geotag.tweetid == Tweet.tweetid).\
-                    filter(sa.func.upper(Tweet.lang) == lang.upper())
-
-        if limit is not None:
-            return thisQuery.limit(limit).all()
-        else:
-            return thisQuery.all()
+        locations = []
+        for _ in self.eachPartition(start, stop):
+            thisQuery = self.session.query(Geotag.latitude, Geotag.longitude, Tweet.date).\
+                        filter(Tweet.date >= start).\
+                        filter(Tweet.date <= stop).\
+                        filter(Geotag.date >= start).\
+                        filter(Geotag.date <= stop).\
+                        filter(Geotag.tweetid == Tweet.tweetid).\
+                        filter(self.langFilter(lang))
+            if limit is not None:
+                thisQuery = thisQuery.limit(limit - len(locations))
+            locations.extend(thisQuery.all())
+            if limit is not None and len(locations) >= limit:
+                break
+        return locations
 
     def getPopularHashtags(self, start, stop=None, lang='en', limit=None):
         if stop is None:
             stop = dt.utcnow()
+        totals = {}
+        for _ in self.eachPartition(start, stop):
+            thisQuery = self.session.query(HashtagLexicon.hashtagtext,
+                                           sa.func.count(Hashtag.hashid)).\
+                filter(Hashtag.hashtagid == HashtagLexicon.hashtagid).\
+                filter(Hashtag.tweetid == Tweet.tweetid).\
+                filter(Hashtag.date >= start).\
+                filter(Hashtag.date <= stop).\
+                filter(self.langFilter(lang)).\
+                filter(Tweet.date >= start).\
+                filter(Tweet.date <= stop).\
+                group_by(HashtagLexicon.hashtagtext)
+            for tag, total in thisQuery:
+                totals[tag] = totals.get(tag, 0) + total
 
-        thisQuery = self.session.query(Hashtag.tag,
-                                       sa.func.count(Hashtag.tag).\
-                                       label('total')).\
-            group_by(Hashtag.tag).join(Tweet).\
-            filter(Hashtag.tweetid == Tweet.tweetid).\
-            filter(sa.func.upper(Tweet.lang) == lang.upper()).\
-            filter(Tweet.date >= start).\
-            filter(Tweet.date <= stop).\
-            order_by('total desc')
-
+        hashtags = sorted(totals.items(), key=lambda item: -item[1])
         if limit is not None:
-            return thisQuery.limit(limit).all()
+            return hashtags[:limit]
         else:
-            return thisQuery.all()
+            return hashtags
+
+    def getMentionGraph(self, start=None, stop=None, cache=None):
+        # numpy is only needed for graph work, so import it on demand
+        import graph
+        return graph.get_mention_graph(self.session, start, stop, cache,
+                                       partition.id_ranges(self.parmdata,
+                                                           start, stop),
+                                       self.pruneRange)
+
+    def getDocumentTermMatrix(self, start=None, stop=None, lang='en',
+                              min_df=1, tfidf=False, cache=None):
+        # numpy is only needed for matrix work, so import it on demand
+        import docterm
+        return docterm.get_document_term_matrix(
+            self.session, start, stop, lang, [self.langFilter(lang)], min_df,
+            tfidf, cache, partition.id_ranges(self.parmdata, start, stop),
+            self.pruneRange)
+
+    def eachPartition(self, start, stop):
+        '''
+        Loop over [start, stop] with its partitions attached, so queries
+        over any number of partitions can be run piecewise and their
+        results combined.  Windows SQLite can attach in one go are done in
+        one pass, which leaves the returned tweets able to lazy load their
+        hashtags and so on; longer ones go one partition.id_ranges() range
+        at a time.
+        '''
+        ranges = partition.id_ranges(self.parmdata, start, stop)
+        if len(ranges) <= partition.MAX_ATTACHED:
+            partition.prune(self.session, self.parmdata, start, stop)
+            yield None, None
+            return
+        for lo, hi in ranges:
+            self.pruneRange(lo, hi)
+            yield lo, hi
+
+    def pruneRange(self, lo, hi):
+        '''
+        Attach just the partition holding [lo, hi), so windows spanning
+        any number of partitions can be read one partition at a time.
+        '''
+        partition.prune(self.session, self.parmdata, lo,
+                        hi - timedelta(microseconds=1))
+
+    def langFilter(self, lang):
+        '''
+        Filter on Tweet.langid for a language code.  The code is looked up
+        in the LangLexicon once and the ids are remembered.
+        '''
+        key = lang.upper()
+        if key not in self.langids:
+            ids = [row[0] for row in self.session.query(LangLexicon.id).
+                   filter(sa.func.upper(LangLexicon.text) == key)]
+            if len(ids) == 0:
+                # nothing stored in this language (yet), don't remember that
+                return sa.false()
+            self.langids[key] = ids
+        return Tweet.langid.in_(self.langids[key])
 
     def refresh_session(self):
+        # hand the old session's connection back to the pool
+        self.session.close()
         self.session = tdb.get_sql_session(self.parmdata)
 
     def __init__(self, parmfile, parmdata=None):
@@ -75,4 +148,5 @@ class DatabaseInterrogator(object):
             self.parmdata = tdb.read_parmdata(parmfile)
         else:
             self.parmdata = parmdata
+        self.langids = {}
         self.session = tdb.get_sql_session(self.parmdata)
@@ -0,0 +1,310 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Rate-limit-aware parallel timeline backfill."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import json
+import logging
+import os
+import threading
+import time
+from Queue import Queue, Empty
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+# twitter won't return more than 200 tweets per user_timeline call
+PAGE_SIZE = 200
+
+
+class RateLimited(Exception):
+    '''
+    Raised by API objects (e.g. FakeTimelineAPI) when a rate limit window is
+    exhausted.  reset is the number of seconds until the window reopens.
+    '''
+
+    def __init__(self, reset):
+        Exception.__init__(self, 'Rate limit exceeded, resets in %.1fs'
+                           % reset)
+        self.reset = reset
+
+
+def rate_limit_reset(exc, window):
+    '''
+    Returns the number of seconds to wait if exc is a rate limit error
+    (from tweepy or RateLimited), otherwise None.
+    '''
+    if isinstance(exc, RateLimited):
+        return exc.reset
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status', None) or \
+        getattr(response, 'status_code', None)
+    if status != 429 and getattr(exc, 'api_code', None) != 88:
+        return None
+    headers = getattr(response, 'headers', None) or {}
+    reset = headers.get('x-rate-limit-reset')
+    if reset is None:
+        return window
+    return max(float(reset) - time.time(), 0.0)
+
+
+class TokenBucket(object):
+    '''
+    Thread-safe token bucket pacing requests to one API endpoint.  The
+    bucket holds up to `requests` tokens and refills at requests/window
+    tokens per second.
+    '''
+
+    def __init__(self, requests, window, clock=time.time, sleep=time.sleep):
+        self.capacity = float(requests)
+        self.rate = requests / window
+        self.tokens = float(requests)
+        self.clock = clock
+        self.sleep = sleep
+        self.last = clock()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.last) * self.rate)
+                self.last = now
+                if now >= self.blocked_until and self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = max(self.blocked_until - now,
+                           (1.0 - self.tokens) / self.rate)
+            self.sleep(wait)
+
+    def block(self, seconds):
+        '''
+        The server told us the window is exhausted; hold every fetcher off
+        until it resets.
+        '''
+        with self.lock:
+            self.tokens = 0.0
+            self.last = self.clock()
+            self.blocked_until = max(self.blocked_until,
+                                     self.last + seconds)
+
+
+class BackfillCheckpoint(object):
+    '''
+    Per-user since_id/max_id progress, persisted as JSON so an interrupted
+    backfill can resume.  For each user we keep:
+      since_id -- newest tweet id captured by the last completed walk
+      max_id   -- where the current walk should continue from (None when
+                  no walk is in progress)
+      newest   -- newest tweet id seen by the current walk
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.users = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.users = json.load(f)
+
+    def get(self, userid):
+        with self.lock:
+            return dict(self.users.get(str(userid), {}))
+
+    def update(self, userid, **kwargs):
+        with self.lock:
+            self.users.setdefault(str(userid), {}).update(kwargs)
+            self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        # write then rename so a crash never leaves a truncated checkpoint
+        tmpfile = self.path + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(self.users, f)
+        os.rename(tmpfile, self.path)
+
+
+class BackfillScheduler(object):
+    '''
+    Backfills the timelines of many users.  num_fetchers threads walk user
+    timelines concurrently, all drawing from shared token buckets sized to
+    the API's rate limit windows.  Fetched pages are queued to a single
+    writer thread which hands them to write_page (e.g. tdb.add_tweets) and
+    only then advances the user's checkpoint.
+    '''
+
+    def __init__(self, api, write_page, checkpoint=None, num_fetchers=4,
+                 timeline_requests=900, user_requests=900, window=900,
+                 write_user=None, queue_size=100):
+        self.api = api
+        self.write_page = write_page
+        self.write_user = write_user
+        self.checkpoint = checkpoint or BackfillCheckpoint()
+        self.num_fetchers = num_fetchers
+        self.window = window
+        self.timeline_bucket = TokenBucket(timeline_requests, window)
+        self.user_bucket = TokenBucket(user_requests, window)
+        self.pages = Queue(queue_size)
+        self.errors = []
+        self.n_pages = 0
+        self.n_tweets = 0
+
+    def run(self, userids):
+        userids = list(userids)
+        users = Queue()
+        for userid in userids:
+            users.put(userid)
+
+        writer = threading.Thread(target=self._write, name='backfill_writer')
+        writer.daemon = True
+        writer.start()
+
+        fetchers = []
+        for i in range(min(self.num_fetchers, len(userids))):
+            fetcher = threading.Thread(target=self._fetch, args=(users,),
+                                       name='backfill_fetcher_%d' % i)
+            fetcher.daemon = True
+            fetcher.start()
+            fetchers.append(fetcher)
+
+        for fetcher in fetchers:
+            fetcher.join()
+        self.pages.put(None)
+        writer.join()
+        log.info('Backfill wrote %d tweets in %d pages (%d users failed).' %
+                 (self.n_tweets, self.n_pages, len(self.errors)))
+
+    def _call(self, bucket, method, **kwargs):
+        # make an API call, waiting out any rate limit window we hit
+        kwargs = dict((k, v) for k, v in kwargs.items() if v is not None)
+        while True:
+            bucket.acquire()
+            try:
+                return method(**kwargs)
+            except Exception as e:
+                wait = rate_limit_reset(e, self.window)
+                if wait is None:
+                    raise
+                log.info('Rate limited, pausing %.0f seconds.' % wait)
+                bucket.block(wait)
+
+    def _fetch(self, users):
+        while not users.empty():
+            try:
+                userid = users.get_nowait()
+            except Empty:
+                return
+            try:
+                self._walk(userid)
+            except Exception as e:
+                log.error('Backfill of user %s failed: %s' % (userid, str(e)))
+                self.errors.append((userid, e))
+
+    def _walk(self, userid):
+        state = self.checkpoint.get(userid)
+        since_id = state.get('since_id')
+        max_id = state.get('max_id')
+        newest = state.get('newest')
+
+        if self.write_user is not None and max_id is None:
+            rawuser = self._call(self.user_bucket, self.api.get_user,
+                                 user_id=userid)
+            self.pages.put(('user', userid, rawuser, None, None))
+
+        while True:
+            page = self._call(self.timeline_bucket, self.api.user_timeline,
+                              user_id=userid, count=PAGE_SIZE,
+                              since_id=since_id, max_id=max_id)
+            if len(page) == 0:
+                break
+            ids = [tweet.id for tweet in page]
+            newest = max(ids + ([newest] if newest is not None else []))
+            max_id = min(ids) - 1
+            self.pages.put(('page', userid, page, max_id, newest))
+
+        # walk complete, next run only needs tweets newer than this one
+        self.pages.put(('done', userid, None, None,
+                        newest if newest is not None else since_id))
+
+    def _write(self):
+        # users with a failed write; the rest of their walk is dropped so
+        # the checkpoint stays at the last page written and a resumed run
+        # fetches the failed page again
+        failed = set()
+        while True:
+            item = self.pages.get()
+            if item is None:
+                return
+            kind, userid, page, max_id, newest = item
+            if userid in failed:
+                continue
+            try:
+                if kind == 'done':
+                    self.checkpoint.update(userid, since_id=newest,
+                                           max_id=None, newest=None)
+                elif kind == 'user':
+                    self.write_user(page)
+                else:
+                    self.write_page(page)
+                    self.checkpoint.update(userid, max_id=max_id,
+                                           newest=newest)
+                    self.n_pages += 1
+                    self.n_tweets += len(page)
+            except Exception as e:
+                log.error('Writing backfill page for user %s failed, '
+                          'skipping the rest of their timeline: %s'
+                          % (userid, str(e)))
+                self.errors.append((userid, e))
+                failed.add(userid)
+
+
+class FakeTimelineAPI(object):
+    '''
+    Stand-in for tweepy.API serving canned timelines from memory and
+    enforcing a per-window request limit, for exercising the scheduler
+    without touching twitter.  timelines maps userid -> list of status
+    objects (anything with an .id), in any order.
+    '''
+
+    def __init__(self, timelines, requests=900, window=900, users=None,
+                 clock=time.time):
+        self.timelines = dict((userid, sorted(tweets, key=lambda t: -t.id))
+                              for userid, tweets in timelines.items())
+        self.users = users or {}
+        self.requests = requests
+        self.window = window
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.window_start = clock()
+        self.n_calls = 0
+        self.n_limited = 0
+
+    def _count(self):
+        with self.lock:
+            now = self.clock()
+            if now - self.window_start >= self.window:
+                self.window_start = now
+                self.n_calls = 0
+            if self.n_calls >= self.requests:
+                self.n_limited += 1
+                raise RateLimited(self.window_start + self.window - now)
+            self.n_calls += 1
+
+    def get_user(self, user_id):
+        self._count()
+        return self.users[user_id]
+
+    def user_timeline(self, user_id, count=20, since_id=None, max_id=None):
+        self._count()
+        page = [t for t in self.timelines.get(user_id, [])
+                if (since_id is None or t.id > since_id) and
+                (max_id is None or t.id <= max_id)]
+        return page[:count]
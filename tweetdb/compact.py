@@ -0,0 +1,412 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Retention compaction of raw tweet rows into daily summaries."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+'''
+Compaction works through the raw data one day at a time, oldest first, up
+to a configured age.  The tweets a day holds when it is compacted make up
+one batch, and each batch goes through three phases:
+
+  summarized -- the batch's tweet ids are recorded in CompactedTweet and
+                their word, hashtag, language and geo-cell counts are added
+                to the Daily* tables, all in one transaction
+  exported   -- the batch's raw Tweet, Hashtag, Mention, URLData, Geotag,
+                TweetWord and Media rows are written to gzipped JSON lines
+                files under archive_path/YYYY-MM-DD/, which replay_archive
+                can load back (image files stored on disk stay where they
+                are)
+  deleted    -- the batch's raw rows are deleted batch_size tweets at a
+                time, each in its own short transaction
+
+Export and delete only touch the tweets recorded at summarize, so tweets
+that arrive for the day in the meantime are left alone.  Any raw rows a
+later run finds for a compacted day (e.g. from a backfill) are compacted as
+the day's next batch: their counts are added to the summaries and they are
+archived to TABLE.<batch>.jsonl.gz alongside the first batch's files.
+
+The last completed (day, batch, phase) is checkpointed to a JSON file, so
+the job can be stopped at any point and picks up where it left off.
+'''
+
+import base64
+import glob
+import gzip
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime as dt
+from datetime import timedelta
+import sqlalchemy as sa
+from models import Tweet, Hashtag, Mention, URLData, Geotag, \
+    TweetWord, Media, LangLexicon, DailyWordCount, DailyHashtagCount, \
+    DailyLangCount, DailyGeoCount, CompactedTweet, lexicon_id
+import partition
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+# raw tables archived and deleted by compaction, parents first
+RAW_TABLES = [Tweet, Hashtag, Mention, URLData, Geotag, TweetWord, Media]
+
+# tweets without a language are summarized under twitter's code for an
+# undetermined language
+UNKNOWN_LANG = 'und'
+
+PHASES = ['summarized', 'exported', 'deleted']
+
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def _encoder(table):
+    # turn column values into JSON values
+    binary = [c.name for c in table.columns
+              if isinstance(c.type, sa.LargeBinary)]
+
+    def encode(row):
+        row = dict(row.items())
+        for name, value in row.items():
+            if isinstance(value, dt):
+                row[name] = value.isoformat()
+            elif name in binary and value is not None:
+                row[name] = base64.b64encode(value)
+        return row
+    return encode
+
+
+def _decoder(table):
+    # turn archived JSON values back into column values
+    dates = [c.name for c in table.columns
+             if isinstance(c.type, sa.DateTime)]
+    binary = [c.name for c in table.columns
+              if isinstance(c.type, sa.LargeBinary)]
+
+    def decode(row):
+        for name in binary:
+            if row.get(name) is not None:
+                row[name] = base64.b64decode(row[name])
+        for name in dates:
+            if row.get(name) is not None:
+                value = row[name]
+                fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value \
+                    else '%Y-%m-%dT%H:%M:%S'
+                row[name] = dt.strptime(value, fmt)
+        return row
+    return decode
+
+
+def _archive_name(table, batch):
+    if batch == 1:
+        return table.name + '.jsonl.gz'
+    return '%s.%d.jsonl.gz' % (table.name, batch)
+
+
+def _compacted(day, batch=None):
+    # ids of the tweets compacted from day, by one batch or all of them
+    query = sa.select([CompactedTweet.tweetid]).\
+        where(CompactedTweet.day == day)
+    if batch is not None:
+        query = query.where(CompactedTweet.batch == batch)
+    return query
+
+
+def _in_day(model, start, stop):
+    # Media has no date of its own (and isn't partitioned), so it's
+    # matched through its tweet
+    if model is Media:
+        return Media.tweetid.in_(sa.select([Tweet.tweetid]).
+                                 where(Tweet.date >= start).
+                                 where(Tweet.date < stop))
+    return sa.and_(model.date >= start, model.date < stop)
+
+
+class CompactionCheckpoint(object):
+    '''
+    The last day, batch and phase compaction completed, kept in a JSON
+    file.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.day = None
+        self.batch = None
+        self.phase = None
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                state = json.load(f)
+            self.day = dt.strptime(state['day'], DAY_FORMAT)
+            self.batch = state.get('batch', 1)
+            self.phase = state['phase']
+
+    def unfinished(self):
+        return self.day is not None and self.phase != PHASES[-1]
+
+    def done(self, day, batch, phase):
+        if (self.day, self.batch) != (day, batch):
+            return False
+        return PHASES.index(phase) <= PHASES.index(self.phase)
+
+    def update(self, day, batch, phase):
+        self.day = day
+        self.batch = batch
+        self.phase = phase
+        tmpfile = self.path + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump({'day': day.strftime(DAY_FORMAT), 'batch': batch,
+                       'phase': phase}, f)
+        os.rename(tmpfile, self.path)
+
+
+class Compactor(object):
+    def __init__(self, parmdata, get_session):
+        self.parmdata = parmdata
+        settings = parmdata['settings']['compaction']
+        self.age = timedelta(days=settings['age_days'])
+        self.archive_path = settings['archive_path']
+        self.batch_size = settings.get('batch_size', 5000)
+        self.pause = settings.get('pause', 0.1)
+        self.geo_cell = settings.get('geo_cell', 1.0)
+        self.checkpoint = CompactionCheckpoint(settings['checkpoint'])
+        self.sessions = partition.PartitionedSessions(parmdata, get_session)
+        self.partitions = partition.partition_settings(parmdata)
+        self.sqlite_partitions = self.partitions is not None and \
+            parmdata['database']['db_type'].upper() == 'SQLITE'
+
+    def run(self, now=None):
+        if now is None:
+            now = dt.utcnow()
+        cutoff = dt(now.year, now.month, now.day) - self.age
+        # finish the batch an earlier run was stopped in the middle of
+        if self.checkpoint.unfinished():
+            self.compact_day(self.checkpoint.day, self.checkpoint.batch)
+        # every raw row left before the cutoff is either a day we haven't
+        # reached yet or one that arrived after its day was compacted
+        day = self.first_day()
+        while day is not None and day < cutoff:
+            if self.has_data(day):
+                session = self.sessions.get(day)
+                if session.query(Tweet.tweetid).\
+                        filter(_in_day(Tweet, day, day + timedelta(days=1))).\
+                        first() is not None:
+                    self.compact_day(day, self.next_batch(session, day))
+                session.commit()
+            day += timedelta(days=1)
+        self.sessions.close()
+
+    def first_day(self):
+        if self.sqlite_partitions:
+            sessions = [self.sessions.get(start) for start in
+                        sorted(partition.sqlite_partitions(self.partitions))]
+        else:
+            sessions = [self.sessions.get(dt.utcnow())]
+        for session in sessions:
+            first = session.query(sa.func.min(Tweet.date)).scalar()
+            session.commit()
+            if first is not None:
+                return dt(first.year, first.month, first.day)
+        return None
+
+    def next_batch(self, session, day):
+        last = session.query(sa.func.max(CompactedTweet.batch)).\
+            filter(CompactedTweet.day == day).scalar()
+        return 1 if last is None else last + 1
+
+    def has_data(self, day):
+        # don't let the SQLite sessions create empty period files
+        if not self.sqlite_partitions:
+            return True
+        period = self.partitions['period'].lower()
+        return partition.period_start(day, period) in \
+            partition.sqlite_partitions(self.partitions)
+
+    def compact_day(self, day, batch):
+        session = self.sessions.get(day)
+        for phase, step in zip(PHASES, [self.summarize, self.export,
+                                        self.delete]):
+            if self.checkpoint.done(day, batch, phase):
+                continue
+            step(session, day, day + timedelta(days=1), batch)
+            self.checkpoint.update(day, batch, phase)
+            log.info('Compaction of %s batch %d %s.' %
+                     (day.strftime(DAY_FORMAT), batch, phase))
+
+    def summarize(self, session, start, stop, batch):
+        if session.query(CompactedTweet.tweetid).\
+                filter(CompactedTweet.day == start).\
+                filter(CompactedTweet.batch == batch).first() is not None:
+            # committed, but we stopped before the checkpoint was written
+            session.commit()
+            return
+        inday = sa.and_(Tweet.date >= start, Tweet.date < stop,
+                        Tweet.tweetid.in_(_compacted(start, batch)))
+        try:
+            if batch > 1:
+                # tweets read again after an earlier batch archived them
+                # are already counted
+                for model in reversed(RAW_TABLES):
+                    session.query(model).\
+                        filter(model.tweetid.in_(_compacted(start))).\
+                        filter(_in_day(model, start, stop)).\
+                        delete(synchronize_session=False)
+            session.execute(CompactedTweet.__table__.insert().from_select(
+                ['day', 'batch', 'tweetid'],
+                sa.select([sa.literal(start, sa.DateTime),
+                           sa.literal(batch, sa.Integer), Tweet.tweetid]).
+                where(_in_day(Tweet, start, stop))))
+            langid = sa.func.coalesce(
+                Tweet.langid, lexicon_id(session, LangLexicon, UNKNOWN_LANG))
+
+            rows = session.query(TweetWord.wordid, langid,
+                                 sa.func.count(TweetWord.id)).\
+                filter(TweetWord.tweetid == Tweet.tweetid).\
+                filter(TweetWord.date >= start).\
+                filter(TweetWord.date < stop).\
+                filter(inday).group_by(TweetWord.wordid, langid)
+            self._insert(session, DailyWordCount,
+                         [dict(day=start, wordid=w, langid=l, count=n)
+                          for w, l, n in rows], batch > 1)
+
+            rows = session.query(Hashtag.hashtagid, langid,
+                                 sa.func.count(Hashtag.hashid)).\
+                filter(Hashtag.tweetid == Tweet.tweetid).\
+                filter(Hashtag.date >= start).filter(Hashtag.date < stop).\
+                filter(inday).group_by(Hashtag.hashtagid, langid)
+            self._insert(session, DailyHashtagCount,
+                         [dict(day=start, hashtagid=h, langid=l, count=n)
+                          for h, l, n in rows], batch > 1)
+
+            rows = session.query(langid, sa.func.count(Tweet.tweetid)).\
+                filter(inday).group_by(langid)
+            self._insert(session, DailyLangCount,
+                         [dict(day=start, langid=l, count=n)
+                          for l, n in rows], batch > 1)
+
+            # bin geotags into cells here rather than rely on the
+            # database having floor()
+            cells = {}
+            rows = session.query(Geotag.latitude, Geotag.longitude,
+                                 langid).\
+                filter(Geotag.tweetid == Tweet.tweetid).\
+                filter(Geotag.date >= start).filter(Geotag.date < stop).\
+                filter(inday)
+            for latitude, longitude, langid in rows:
+                key = (langid,
+                       math.floor(latitude / self.geo_cell) * self.geo_cell,
+                       math.floor(longitude / self.geo_cell) * self.geo_cell)
+                cells[key] = cells.get(key, 0) + 1
+            self._insert(session, DailyGeoCount,
+                         [dict(day=start, langid=l, latitude=lat,
+                               longitude=lon, count=n)
+                          for (l, lat, lon), n in cells.items()],
+                         batch > 1)
+            session.commit()
+        except:
+            session.rollback()
+            raise
+
+    def _insert(self, session, summary, rows, merge=False):
+        if len(rows) == 0:
+            return
+        if not merge:
+            session.execute(summary.__table__.insert(), rows)
+            return
+        # a later batch adds to the day's existing counts
+        keys = [c.name for c in summary.__table__.primary_key]
+        for row in rows:
+            existing = session.query(summary).\
+                filter_by(**dict((k, row[k]) for k in keys)).one_or_none()
+            if existing is not None:
+                existing.count += row['count']
+            else:
+                session.add(summary(**row))
+        session.flush()
+
+    def export(self, session, start, stop, batch):
+        directory = os.path.join(self.archive_path,
+                                 start.strftime(DAY_FORMAT))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        for model in RAW_TABLES:
+            table = model.__table__
+            filename = os.path.join(directory, _archive_name(table, batch))
+            query = sa.select([table]).\
+                where(model.tweetid.in_(_compacted(start, batch))).\
+                where(_in_day(model, start, stop))
+            result = session.connection().\
+                execution_options(stream_results=True).execute(query)
+            encode = _encoder(table)
+            # write then rename so a half written archive is never trusted
+            f = gzip.open(filename + '.tmp', 'wb')
+            for row in result:
+                f.write(json.dumps(encode(row)) + '\n')
+            f.close()
+            os.rename(filename + '.tmp', filename)
+        session.commit()
+
+    def delete(self, session, start, stop, batch):
+        '''
+        Delete the batch's raw rows batch_size tweets at a time, committing
+        and pausing between batches so live ingest isn't locked out.
+        '''
+        last = None
+        ndeleted = 0
+        while True:
+            query = session.query(CompactedTweet.tweetid).\
+                filter(CompactedTweet.day == start).\
+                filter(CompactedTweet.batch == batch)
+            if last is not None:
+                query = query.filter(CompactedTweet.tweetid > last)
+            tweetids = [row[0] for row in
+                        query.order_by(CompactedTweet.tweetid).
+                        limit(self.batch_size)]
+            if len(tweetids) == 0:
+                session.commit()
+                break
+            try:
+                for model in reversed(RAW_TABLES):
+                    session.query(model).\
+                        filter(model.tweetid.in_(tweetids)).\
+                        filter(_in_day(model, start, stop)).\
+                        delete(synchronize_session=False)
+                session.commit()
+            except:
+                session.rollback()
+                raise
+            ndeleted += len(tweetids)
+            last = tweetids[-1]
+            time.sleep(self.pause)
+        log.info('Deleted %d tweets from %s.' %
+                 (ndeleted, start.strftime(DAY_FORMAT)))
+
+
+def replay_archive(directory, session, batch_size=5000):
+    '''
+    Load one day of archived raw rows (a directory written by
+    Compactor.export, holding one file per table per batch) back into the
+    database.  The next compaction run deletes the replayed rows again
+    without counting them twice.
+    '''
+    for model in RAW_TABLES:
+        table = model.__table__
+        decode = _decoder(table)
+        batch = []
+        for filename in sorted(glob.glob(os.path.join(directory,
+                                                      table.name +
+                                                      '.*jsonl.gz'))):
+            f = gzip.open(filename, 'rb')
+            for line in f:
+                batch.append(decode(json.loads(line)))
+                if len(batch) >= batch_size:
+                    session.execute(table.insert(), batch)
+                    batch = []
+            f.close()
+        if len(batch) > 0:
+            session.execute(table.insert(), batch)
+        session.commit()
+        log.info('Replayed %s from %s.' % (table.name, directory))
@@ -0,0 +1,217 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Database engine and session factory."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import os
+import time
+import pickle
+import logging
+from yaml import load
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.orm import sessionmaker
+from models import Base
+import partition
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+
+def read_parmdata(parmfile):
+    # parse a YAML parameter file
+    with open(parmfile, 'r') as f:
+        return load(f)
+
+
+# one engine per (process, url, echo), created lazily in the process that
+# uses it so forked consumers never share a parent's pooled connections
+_engines = {}
+
+# pool settings used when the database block has no pool section
+POOL_DEFAULTS = {'size': 5, 'max_overflow': 10, 'recycle': 3600,
+                 'pre_ping': True, 'timeout': 30}
+
+
+class TimedQueuePool(QueuePool):
+    '''
+    QueuePool which records how long checkouts wait for a free connection.
+    '''
+
+    def __init__(self, creator, **kw):
+        QueuePool.__init__(self, creator, **kw)
+        self.stats = None
+
+    def recreate(self):
+        pool = QueuePool.recreate(self)
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return QueuePool._do_get(self)
+        finally:
+            if self.stats is not None:
+                wait = time.time() - start
+                self.stats['wait_total'] += wait
+                self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+
+
+def engine_url(parmdata):
+    if parmdata['database']['db_type'].upper() == 'SQLITE':
+        arg = 'sqlite:///' + parmdata['database']['db_host']
+    elif parmdata['database']['db_type'].upper() == 'POSTGRES':
+        dblogin = pickle.load(open(parmdata['database']['db_login'], 'rb'))
+        arg = 'postgresql://' + dblogin['username'] + ':' + \
+              dblogin['password'] + '@' \
+              + parmdata['database']['db_host'] \
+              + '/' + parmdata['database']['db_name']
+    return arg
+
+
+def pool_settings(parmdata):
+    settings = dict(POOL_DEFAULTS)
+    settings.update(parmdata['database'].get('pool') or {})
+    return settings
+
+
+def get_engine(arg, echo=False, setup=None, **kwargs):
+    '''
+    Returns this process's engine for the url arg, creating it with
+    kwargs on first use.  setup(engine), if given, is run once on a new
+    engine before it is handed out, e.g. to add connect listeners or create
+    tables.
+    '''
+    key = (os.getpid(), arg, echo)
+    if key not in _engines:
+        engine = create_engine(arg, echo=echo, **kwargs)
+        _watch_pool(engine)
+        if setup is not None:
+            setup(engine)
+        _engines[key] = engine
+    return _engines[key]
+
+
+def dispose_engine(arg):
+    '''
+    Close and forget this process's engines for the url arg, e.g. before
+    its database file is removed.
+    '''
+    for key in [k for k in _engines if k[:2] == (os.getpid(), arg)]:
+        _engines.pop(key).dispose()
+
+
+def get_sql_engine(parmdata, echo=False):
+    '''
+    Returns this process's engine for the database, creating it (and its
+    connection pool) on first use.
+    '''
+    arg = engine_url(parmdata)
+    if arg.startswith('sqlite'):
+        # SQLite connections are cheap and can't be shared between
+        # threads, so keep SQLAlchemy's default pool for it
+        return get_engine(arg, echo)
+    settings = pool_settings(parmdata)
+    return get_engine(arg, echo, poolclass=TimedQueuePool,
+                      pool_size=settings['size'],
+                      max_overflow=settings['max_overflow'],
+                      pool_recycle=settings['recycle'],
+                      pool_pre_ping=settings['pre_ping'],
+                      pool_timeout=settings['timeout'])
+
+
+def _watch_pool(engine):
+    stats = dict(connects=0, checkouts=0, checkins=0, wait_total=0.0,
+                 wait_max=0.0)
+    engine.pool_stats = stats
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.stats = stats
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+        stats['connects'] += 1
+
+    @event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        # a connection opened before a fork must not be used by the child;
+        # DisconnectionError makes the pool drop it and connect afresh
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise exc.DisconnectionError('Connection opened in process %d '
+                                         'used in process %d.' %
+                                         (connection_record.info['pid'],
+                                          os.getpid()))
+        stats['checkouts'] += 1
+
+    @event.listens_for(engine, 'checkin')
+    def checkin(dbapi_connection, connection_record):
+        stats['checkins'] += 1
+
+
+def pool_status():
+    '''
+    Returns a dict of pool statistics for each engine this process has
+    created.  Peak connections per process is at most size + overflow, so
+    sum that over consumers and web workers when setting Postgres
+    max_connections.
+    '''
+    status = []
+    for (pid, arg, echo), engine in _engines.items():
+        if pid != os.getpid():
+            continue
+        row = dict(engine.pool_stats, url=repr(engine.url), pid=pid)
+        if isinstance(engine.pool, QueuePool):
+            row.update(size=engine.pool.size(),
+                       checkedout=engine.pool.checkedout(),
+                       overflow=engine.pool.overflow())
+        status.append(row)
+    return status
+
+
+def log_pool_status():
+    for row in pool_status():
+        log.info('Pool %(url)s: %(checkouts)d checkouts, %(connects)d '
+                 'connects, %(wait_total).3fs waiting (max %(wait_max).3fs).'
+                 % row)
+        if 'size' in row:
+            log.info('Pool %(url)s: %(checkedout)d/%(size)d connections '
+                     'checked out, overflow %(overflow)d.' % row)
+
+
+def get_sql_session(parmdata, echo=False):
+    engine = get_sql_engine(parmdata, echo=echo)
+    Session = sessionmaker(bind=engine)
+    return Session()
+
+
+def create_tables(engine, parmdata=None):
+    log.info('Creating database tables.')
+    settings = None
+    if parmdata is not None:
+        settings = partition.partition_settings(parmdata)
+    if settings is None:
+        Base.metadata.create_all(engine)
+    elif engine.dialect.name == 'postgresql':
+        log.info('Partitioning tweets by %s.' % settings['period'])
+        partition.create_postgres_tables(engine)
+    else:
+        # the partitioned tables live in the per-period files
+        log.info('Partitioning tweets by %s into \'%s\'.' %
+                 (settings['period'], settings['path']))
+        Base.metadata.create_all(engine, tables=[
+            t for t in Base.metadata.sorted_tables
+            if t.name not in partition.PARTITIONED])
+
+
+def drop_tables(engine):
+    dropflag = raw_input('WARNING: All tables in database will ' +
+                         'be dropped.  Proceed? [y/N] ')
+    if dropflag.upper() == 'Y':
+        log.info('Dropping database tables.')
+        Base.metadata.drop_all(engine)
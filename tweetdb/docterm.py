@@ -0,0 +1,248 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Sparse document-term matrices built from the TweetWord table."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import os
+import json
+import numpy as np
+import logging
+import sqlalchemy as sa
+from datetime import datetime as dt
+from models import Tweet, TweetWord, TweetLexicon
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+# timestamp format used when caching the matrix window to disk
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# arrays written to (and memory mapped from) the cache directory
+ARRAYS = ['tweetids', 'wordids', 'indptr', 'indices', 'data']
+
+
+def load_tweet_words(session, start=None, stop=None, criteria=(),
+                     chunksize=500000, lo=None, hi=None):
+    '''
+    Generator yielding (tweetid, wordid) numpy arrays for the words of the
+    tweets in [start, stop] matching criteria (extra clauses on Tweet, e.g.
+    a language filter).  Rows are read as plain tuples, paged on
+    TweetWord.id, so no ORM objects are built.  TweetWord ids are only
+    unique within a partition.id_ranges() range, so on partitioned SQLite
+    this is called once per range [lo, hi).
+    '''
+    last = 0
+    while True:
+        thisQuery = sa.select([TweetWord.id, TweetWord.tweetid,
+                               TweetWord.wordid]).\
+            where(TweetWord.tweetid == Tweet.tweetid).\
+            where(TweetWord.id > last)
+        if start is not None:
+            thisQuery = thisQuery.where(Tweet.date >= start).\
+                where(TweetWord.date >= start)
+        if stop is not None:
+            thisQuery = thisQuery.where(Tweet.date <= stop).\
+                where(TweetWord.date <= stop)
+        if lo is not None:
+            thisQuery = thisQuery.where(TweetWord.date >= lo).\
+                where(TweetWord.date < hi)
+        for clause in criteria:
+            thisQuery = thisQuery.where(clause)
+        rows = session.execute(thisQuery.order_by(TweetWord.id).
+                               limit(chunksize)).fetchall()
+        if len(rows) == 0:
+            return
+        chunk = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        last = int(chunk[-1, 0])
+        yield chunk[:, 1], chunk[:, 2]
+
+
+class DocumentTermMatrix(object):
+    '''
+    Tweets by words in CSR form.  Row i is the tweet self.tweetids[i] and
+    column j is the word self.wordids[j] (a TweetLexicon id); data holds
+    term counts, or TF-IDF weights after tfidf().
+    '''
+
+    def __init__(self, settings=None):
+        self.settings = settings if settings is not None else {}
+        self.tweetids = np.empty(0, dtype=np.int64)
+        self.wordids = np.empty(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self.data = np.empty(0, dtype=np.float64)
+
+    @property
+    def shape(self):
+        return (len(self.tweetids), len(self.wordids))
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def build(self, tweetids, wordids):
+        '''
+        Build the matrix from parallel (tweetid, wordid) arrays, remapping
+        both to dense row and column numbers.
+        '''
+        self.tweetids, rows = np.unique(tweetids, return_inverse=True)
+        self.wordids, cols = np.unique(wordids, return_inverse=True)
+        ncols = max(len(self.wordids), 1)
+        key = rows.astype(np.int64) * ncols + cols
+        key, inverse = np.unique(key, return_inverse=True)
+        self.data = np.bincount(inverse).astype(np.float64)
+        self.indices = (key % ncols).astype(np.int32)
+        self.indptr = np.zeros(len(self.tweetids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(key // ncols, minlength=len(self.tweetids)),
+                  out=self.indptr[1:])
+        return self
+
+    def load(self, session, start=None, stop=None, criteria=(),
+             chunksize=500000, ranges=None, prune=None):
+        '''
+        Stream the words of every matching tweet out of the database, one
+        partition.id_ranges() range at a time, and build the matrix.
+        prune(lo, hi), if given, is called before each bounded range is
+        read so only that range's partition need be attached.
+        '''
+        if ranges is None:
+            ranges = [(None, None)]
+        tweetids = []
+        wordids = []
+        for lo, hi in ranges:
+            if prune is not None and lo is not None:
+                prune(lo, hi)
+            for t, w in load_tweet_words(session, start, stop, criteria,
+                                         chunksize, lo, hi):
+                tweetids.append(t)
+                wordids.append(w)
+        if len(tweetids) == 0:
+            return self
+        return self.build(np.concatenate(tweetids), np.concatenate(wordids))
+
+    def documentFrequency(self):
+        return np.bincount(self.indices, minlength=self.shape[1])
+
+    def prune(self, min_df=1):
+        '''
+        Drop the words appearing in fewer than min_df tweets, renumbering
+        the remaining columns.  Tweets left without any words keep their
+        (empty) rows.
+        '''
+        keep = self.documentFrequency() >= min_df
+        if keep.all():
+            return self
+        newcol = np.cumsum(keep) - 1
+        kept = keep[self.indices]
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        self.indptr = np.zeros(self.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows[kept], minlength=self.shape[0]),
+                  out=self.indptr[1:])
+        self.indices = newcol[self.indices[kept]].astype(np.int32)
+        self.data = self.data[kept]
+        self.wordids = self.wordids[keep]
+        return self
+
+    def tfidf(self, normalize=True):
+        '''
+        Reweight term counts by smoothed inverse document frequency,
+        log((1 + n) / (1 + df)) + 1, optionally scaling each row to unit
+        length.
+        '''
+        ndocs = self.shape[0]
+        idf = np.log((1.0 + ndocs) / (1.0 + self.documentFrequency())) + 1.0
+        self.data = self.data * idf[self.indices]
+        if normalize and ndocs > 0:
+            rows = np.repeat(np.arange(ndocs), np.diff(self.indptr))
+            norms = np.sqrt(np.bincount(rows, weights=self.data ** 2,
+                                        minlength=ndocs))
+            norms[norms == 0] = 1.0
+            self.data = self.data / norms[rows]
+        return self
+
+    def vocabulary(self, session, chunksize=10000):
+        '''
+        Returns the word text of each column.
+        '''
+        text = {}
+        for i in range(0, len(self.wordids), chunksize):
+            ids = [int(w) for w in self.wordids[i:i + chunksize]]
+            for wordid, wordtext in session.query(TweetLexicon.wordid,
+                                                  TweetLexicon.wordtext).\
+                    filter(TweetLexicon.wordid.in_(ids)):
+                text[wordid] = wordtext
+        return [text.get(int(w)) for w in self.wordids]
+
+    def toScipy(self):
+        '''
+        Returns the matrix as a scipy.sparse.csr_matrix (sharing arrays).
+        '''
+        # scipy is optional, only needed to hand the matrix to other tools
+        import scipy.sparse
+        return scipy.sparse.csr_matrix((self.data, self.indices,
+                                        self.indptr), shape=self.shape)
+
+    def save(self, path):
+        '''
+        Cache the matrix to a directory of .npy files which fromDirectory
+        can memory map.
+        '''
+        if not os.path.exists(path):
+            os.makedirs(path)
+        settings = os.path.join(path, 'settings.json')
+        if os.path.exists(settings):
+            os.remove(settings)
+        for name in ARRAYS:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        # written last, so a half written cache is never trusted
+        with open(settings, 'w') as f:
+            json.dump(self.settings, f)
+
+    @classmethod
+    def fromDirectory(cls, path, mmap=True):
+        with open(os.path.join(path, 'settings.json'), 'r') as f:
+            matrix = cls(json.load(f))
+        for name in ARRAYS:
+            setattr(matrix, name, np.load(os.path.join(path, name + '.npy'),
+                                          mmap_mode='r' if mmap else None))
+        return matrix
+
+
+def get_document_term_matrix(session, start=None, stop=None, lang=None,
+                             criteria=(), min_df=1, tfidf=False, cache=None,
+                             ranges=None, prune=None):
+    '''
+    Build the document-term matrix for the tweets in [start, stop], or
+    memory map it from the cache directory if it was built with the same
+    settings.  lang only labels the cache; the language filter itself is
+    passed in criteria.  A window with no stop runs up to now and would go
+    stale, so it is never cached.
+    '''
+    if stop is None:
+        stop = dt.utcnow()
+        if cache is not None:
+            log.warning('Not caching the document-term matrix for an '
+                        'open-ended window; give a stop time to cache it.')
+            cache = None
+    window = [t.strftime(TIME_FORMAT) if t is not None else None
+              for t in (start, stop)]
+    settings = dict(start=window[0], stop=window[1], lang=lang,
+                    min_df=min_df, tfidf=tfidf)
+    if cache is not None and \
+       os.path.exists(os.path.join(cache, 'settings.json')):
+        matrix = DocumentTermMatrix.fromDirectory(cache)
+        if matrix.settings == settings:
+            return matrix
+    matrix = DocumentTermMatrix(settings).load(session, start, stop,
+                                                criteria, ranges=ranges,
+                                                prune=prune)
+    matrix.prune(min_df)
+    if tfidf:
+        matrix.tfidf()
+    if cache is not None:
+        matrix.save(cache)
+    return matrix
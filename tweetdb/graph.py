@@ -0,0 +1,361 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "In-memory user mention graph built from the Mention table."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import os
+import numpy as np
+from datetime import datetime as dt
+from models import Tweet, Mention
+
+# timestamp format used when caching the graph window to disk
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def load_mentions(session, start=None, stop=None, after=0, chunksize=100000,
+                  lo=None, hi=None):
+    '''
+    Generator yielding (mentionid, source, target) numpy arrays for the
+    mentions made by tweets in [start, stop].  Rows are paged on mentionid
+    so only one chunk is ever held in memory.  Mention ids are only unique
+    within a partition.id_ranges() range, so on partitioned SQLite this is
+    called once per range [lo, hi).
+    '''
+    last = after
+    while True:
+        thisQuery = session.query(Mention.mentionid, Mention.source,
+                                  Mention.target).\
+            join(Tweet, Mention.tweetid == Tweet.tweetid).\
+            filter(Mention.mentionid > last)
+        if start is not None:
+            thisQuery = thisQuery.filter(Tweet.date >= start).\
+                filter(Mention.date >= start)
+        if stop is not None:
+            thisQuery = thisQuery.filter(Tweet.date <= stop).\
+                filter(Mention.date <= stop)
+        if lo is not None:
+            thisQuery = thisQuery.filter(Mention.date >= lo).\
+                filter(Mention.date < hi)
+        rows = thisQuery.order_by(Mention.mentionid).limit(chunksize).all()
+        if len(rows) == 0:
+            return
+        chunk = np.array(rows, dtype=np.int64).reshape(-1, 3)
+        last = int(chunk[-1, 0])
+        yield chunk[:, 0], chunk[:, 1], chunk[:, 2]
+
+
+def _expand(indptr, indices, nodes):
+    # concatenate the CSR rows of the given nodes without a python loop
+    starts = indptr[nodes]
+    ends = indptr[nodes + 1]
+    lens = ends - starts
+    offsets = np.repeat(ends - np.cumsum(lens), lens) + \
+        np.arange(lens.sum())
+    return indices[offsets]
+
+
+def _build_csr(src, dst, weights, n):
+    # collapse repeated edges and sort by source into CSR arrays
+    key = src.astype(np.int64) * n + dst
+    key, inverse = np.unique(key, return_inverse=True)
+    data = np.bincount(inverse, weights=weights).astype(np.float64)
+    src = key // n
+    indices = (key % n).astype(np.int32)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, indices, data
+
+
+class MentionGraph(object):
+    '''
+    Directed, weighted graph of user mentions.  Users are remapped to dense
+    integer node ids (the position in self.userids) and edges are held in
+    CSR form.  Edges appended by update()/addEdges() are kept in a pending
+    COO buffer which every query also consults, so the CSR arrays are only
+    rebuilt when compact() is called.
+    '''
+
+    def __init__(self, start=None, stop=None):
+        self.start = start
+        self.stop = stop
+        # last mentionid read from each id range, keyed by range start
+        self.lastids = {}
+        self.userids = np.empty(0, dtype=np.int64)
+        self._order = np.empty(0, dtype=np.int64)
+        self._sortedids = np.empty(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self.data = np.empty(0, dtype=np.float64)
+        self._pending_src = []
+        self._pending_dst = []
+        self._reverse = None
+
+    @property
+    def numNodes(self):
+        return len(self.userids)
+
+    @property
+    def numEdges(self):
+        return len(self.indices) + sum(len(s) for s in self._pending_src)
+
+    def nodeIds(self, userids):
+        '''
+        Translate twitter user ids to dense node ids, assigning new node ids
+        to users we haven't seen before.
+        '''
+        userids = np.asarray(userids, dtype=np.int64)
+        pos = np.searchsorted(self._sortedids, userids)
+        found = np.zeros(len(userids), dtype=bool)
+        if len(self._sortedids) > 0:
+            pos = np.minimum(pos, len(self._sortedids) - 1)
+            found = self._sortedids[pos] == userids
+        new = np.unique(userids[~found])
+        if len(new) > 0:
+            self.userids = np.concatenate([self.userids, new])
+            self._order = np.argsort(self.userids, kind='mergesort')
+            self._sortedids = self.userids[self._order]
+            pos = np.searchsorted(self._sortedids, userids)
+        return self._order[pos]
+
+    def addEdges(self, sources, targets):
+        '''
+        Append source->target mentions (twitter user ids) without rebuilding
+        the CSR arrays.
+        '''
+        if len(sources) == 0:
+            return
+        self._pending_src.append(self.nodeIds(sources))
+        self._pending_dst.append(self.nodeIds(targets))
+        self._reverse = None
+
+    def load(self, session, chunksize=100000, ranges=None, prune=None):
+        '''
+        Stream every mention in the graph's time window into the graph and
+        build the CSR arrays.
+        '''
+        self.update(session, chunksize=chunksize, ranges=ranges, prune=prune)
+        self.compact()
+        return self
+
+    def update(self, session, chunksize=100000, ranges=None, prune=None):
+        '''
+        Incrementally append mentions ingested since the last load/update.
+        ranges are the partition.id_ranges() to read, each keeping its own
+        last mentionid; the default is one range covering everything.
+        prune(lo, hi), if given, is called before each bounded range is
+        read so only that range's partition need be attached.
+        '''
+        if ranges is None:
+            ranges = [(None, None)]
+        for lo, hi in ranges:
+            if prune is not None and lo is not None:
+                prune(lo, hi)
+            for mentionids, sources, targets in load_mentions(
+                    session, self.start, self.stop,
+                    self.lastids.get(lo, 0), chunksize, lo, hi):
+                self.addEdges(sources, targets)
+                self.lastids[lo] = int(mentionids[-1])
+        return self
+
+    def compact(self):
+        '''
+        Fold pending edges into the CSR arrays.
+        '''
+        src, dst, weights = self.edges()
+        self.indptr, self.indices, self.data = \
+            _build_csr(src, dst, weights, self.numNodes)
+        self._pending_src = []
+        self._pending_dst = []
+        self._reverse = None
+
+    def edges(self):
+        '''
+        Returns (source, target, weight) node id arrays for every edge,
+        including those not yet compacted.
+        '''
+        nbase = len(self.indptr) - 1
+        src = [np.repeat(np.arange(nbase, dtype=np.int64),
+                         np.diff(self.indptr))]
+        dst = [self.indices.astype(np.int64)]
+        weights = [self.data]
+        for psrc, pdst in zip(self._pending_src, self._pending_dst):
+            src.append(psrc)
+            dst.append(pdst)
+            weights.append(np.ones(len(psrc), dtype=np.float64))
+        return np.concatenate(src), np.concatenate(dst), \
+            np.concatenate(weights)
+
+    def outDegree(self, weighted=False):
+        return self._degree(0, weighted)
+
+    def inDegree(self, weighted=False):
+        return self._degree(1, weighted)
+
+    def _degree(self, column, weighted):
+        src, dst, weights = self.edges()
+        if not weighted and len(self._pending_src) > 0:
+            # pending edges may repeat edges already in the CSR arrays
+            key = np.unique(src * max(self.numNodes, 1) + dst)
+            src = key // max(self.numNodes, 1)
+            dst = key % max(self.numNodes, 1)
+            weights = None
+        elif not weighted:
+            weights = None
+        nodes = src if column == 0 else dst
+        return np.bincount(nodes, weights=weights,
+                           minlength=self.numNodes).astype(np.float64)
+
+    def pagerank(self, alpha=0.85, tol=1.0e-6, max_iter=100):
+        '''
+        Weighted PageRank by power iteration.  Each iteration is a single
+        bincount over the edge list; rank held by users who never mention
+        anyone is spread uniformly.
+        '''
+        n = self.numNodes
+        if n == 0:
+            return np.empty(0, dtype=np.float64)
+        src, dst, weights = self.edges()
+        outweight = np.bincount(src, weights=weights, minlength=n)
+        dangling = outweight == 0
+        scale = np.zeros(n, dtype=np.float64)
+        scale[~dangling] = 1.0 / outweight[~dangling]
+        weights = weights * scale[src]
+        rank = np.ones(n, dtype=np.float64) / n
+        for i in range(max_iter):
+            newrank = np.bincount(dst, weights=rank[src] * weights,
+                                  minlength=n)
+            newrank = alpha * (newrank + rank[dangling].sum() / n) + \
+                (1.0 - alpha) / n
+            err = np.abs(newrank - rank).sum()
+            rank = newrank
+            if err < n * tol:
+                break
+        return rank
+
+    def top(self, scores, limit=10):
+        '''
+        Returns [(userid, score), ...] for the highest scoring users.
+        '''
+        best = np.argsort(scores)[::-1][:limit]
+        return [(int(self.userids[i]), float(scores[i])) for i in best]
+
+    def neighborhood(self, userids, hops=1, direction='out'):
+        '''
+        Returns the twitter user ids reachable from (direction='out') or
+        reaching (direction='in') the given users within the given number
+        of hops, excluding the users themselves.
+        '''
+        indptr, indices, psrc, pdst = self._adjacency(direction)
+        userids = np.atleast_1d(np.asarray(userids, dtype=np.int64))
+        pos = np.searchsorted(self._sortedids, userids)
+        known = np.zeros(len(userids), dtype=bool)
+        if len(self._sortedids) > 0:
+            pos = np.minimum(pos, len(self._sortedids) - 1)
+            known = self._sortedids[pos] == userids
+        frontier = np.unique(self._order[pos[known]])
+        seen = np.zeros(self.numNodes, dtype=bool)
+        seen[frontier] = True
+        nbase = len(indptr) - 1
+        for i in range(hops):
+            if len(frontier) == 0:
+                break
+            reached = [_expand(indptr, indices, frontier[frontier < nbase])]
+            if len(psrc) > 0:
+                reached.append(pdst[np.isin(psrc, frontier)])
+            reached = np.unique(np.concatenate(reached))
+            frontier = reached[~seen[reached]]
+            seen[frontier] = True
+        seen[self._order[pos[known]]] = False
+        return self.userids[seen]
+
+    def _adjacency(self, direction):
+        if len(self._pending_src) > 0:
+            psrc = np.concatenate(self._pending_src)
+            pdst = np.concatenate(self._pending_dst)
+        else:
+            psrc = pdst = np.empty(0, dtype=np.int64)
+        if direction == 'out':
+            return self.indptr, self.indices, psrc, pdst
+        elif direction != 'in':
+            raise ValueError('direction must be \'in\' or \'out\'')
+        if self._reverse is None:
+            nbase = len(self.indptr) - 1
+            src = np.repeat(np.arange(nbase, dtype=np.int64),
+                            np.diff(self.indptr))
+            indptr, indices, data = _build_csr(self.indices.astype(np.int64),
+                                               src, self.data, nbase)
+            self._reverse = (indptr, indices)
+        return self._reverse[0], self._reverse[1], pdst, psrc
+
+    def save(self, path):
+        '''
+        Cache the graph (including pending edges) to a .npz file.
+        '''
+        if len(self._pending_src) > 0:
+            psrc = np.concatenate(self._pending_src)
+            pdst = np.concatenate(self._pending_dst)
+        else:
+            psrc = pdst = np.empty(0, dtype=np.int64)
+        window = [t.strftime(TIME_FORMAT) if t is not None else ''
+                  for t in (self.start, self.stop)]
+        rangestarts = [lo.strftime(TIME_FORMAT) if lo is not None else ''
+                       for lo in self.lastids]
+        with open(path, 'wb') as f:
+            np.savez(f, userids=self.userids, indptr=self.indptr,
+                     indices=self.indices, data=self.data,
+                     pending_src=psrc, pending_dst=pdst,
+                     rangestarts=np.array(rangestarts, dtype=str),
+                     lastids=np.array(self.lastids.values(),
+                                      dtype=np.int64),
+                     window=np.array(window))
+
+    @classmethod
+    def fromFile(cls, path):
+        '''
+        Load a graph written by save(), or None if the file predates the
+        per range mention ids.
+        '''
+        cached = np.load(path)
+        if 'lastids' not in cached.files:
+            return None
+        window = [dt.strptime(str(t), TIME_FORMAT) if str(t) else None
+                  for t in cached['window']]
+        graph = cls(window[0], window[1])
+        for lo, lastid in zip(cached['rangestarts'], cached['lastids']):
+            lo = dt.strptime(str(lo), TIME_FORMAT) if str(lo) else None
+            graph.lastids[lo] = int(lastid)
+        graph.userids = cached['userids']
+        graph._order = np.argsort(graph.userids, kind='mergesort')
+        graph._sortedids = graph.userids[graph._order]
+        graph.indptr = cached['indptr']
+        graph.indices = cached['indices']
+        graph.data = cached['data']
+        if len(cached['pending_src']) > 0:
+            graph._pending_src = [cached['pending_src']]
+            graph._pending_dst = [cached['pending_dst']]
+        return graph
+
+
+def get_mention_graph(session, start=None, stop=None, cache=None,
+                      ranges=None, prune=None):
+    '''
+    Build the mention graph for [start, stop], or load it from the cache
+    file and append whatever has been ingested since it was written.
+    '''
+    if cache is not None and os.path.exists(cache):
+        graph = MentionGraph.fromFile(cache)
+        if graph is None or graph.start != start or graph.stop != stop:
+            graph = MentionGraph(start, stop).load(session, ranges=ranges,
+                                                   prune=prune)
+        else:
+            graph.update(session, ranges=ranges, prune=prune)
+    else:
+        graph = MentionGraph(start, stop).load(session, ranges=ranges,
+                                               prune=prune)
+    if cache is not None:
+        graph.save(cache)
+    return graph
@@ -0,0 +1,327 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Pipeline for adding tweets to the database."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import logging
+import os
+import re
+from multiprocessing import Process
+from datetime import datetime as dt
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import IntegrityError
+from models import Hashtag, Mention, URLData, Geotag, Media, TweetWord, \
+    Tweet, User
+from database import get_sql_session, log_pool_status
+from partition import PartitionedSessions
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+
+def drop_images(parmdata):
+    image_path = parmdata['settings']['image_storage']['path']
+    dropflag = raw_input('WARNING: Image storage directory ' +
+                         '(\'%s\') will be' % (image_path) +
+                         'deleted.  Proceed? [y/N] ')
+    if dropflag.upper() == 'Y':
+        log.info('Remove image directory.')
+        os.system('rm -fr "%s"' % image_path)
+
+
+def read_timeline(engine, auth, parmdata, userid=None):
+    # tweepy is only needed on the ingest side
+    import tweepy
+    api = tweepy.API(auth)
+    
+    try:
+        # make session
+        Session = sessionmaker(bind=engine)
+        session = Session()
+
+        # handle user info
+        rawuser = api.get_user(userid)
+        add_user(rawuser, session)
+
+        # get tweets
+        myCursor = tweepy.Cursor(api.user_timeline, id=userid)
+        for rawtweet in myCursor.items():
+            add_tweet(rawtweet, session, parmdata['settings']['get_images'])
+
+        # commit
+        session.commit()
+    except:
+        session.rollback()
+        session.close()
+        raise
+  
+    session.close()
+
+
+def tweet_words(text):
+    # make the text all lower case
+    text = text.lower()
+
+    # strip off URL data
+    text = re.sub('((www\.[^\s]+)|(https?://[^\s]+))', '', text)
+
+    # strip off mentions
+    text = re.sub('@[^\s]+', '', text)
+
+    # remove additional white spaces
+    text = re.sub('[\s]+', ' ', text)
+
+    # replace hashtags with a word
+    text = re.sub(r'#([^\s]+)', r'\1', text)
+
+    # trim
+    text = text.strip('\'"')
+
+    # split into words
+    words = text.split()
+    goodwords = []
+    for word in words:
+        word = word.strip('\'"?,.!;:')
+        # check if the word stats with an alphabet
+        val = re.search(r"^[a-zA-Z][a-zA-Z0-9]*$", word)
+
+        # keep only words of length 2 or more
+        if (val is None or len(word) < 3):
+            continue
+        else:
+            goodwords.append(word)
+
+    return goodwords
+
+
+def add_tweet(tweet, session, get_images=False, image_path=None, https=None,
+              commit=True):
+    # check if we've already added this tweet
+    # filtering on date as well lets partitioned databases prune
+    thisTweet = session.query(Tweet).filter(Tweet.tweetid == tweet.id).\
+        filter(Tweet.date == tweet.created_at)
+    if thisTweet.count() == 0:
+        tweetobj = Tweet(tweet, session)
+        session.add(tweetobj)
+      
+        for tag in tweet.entities['hashtags']:
+            hashobj = Hashtag(tweet, tag, session)
+            session.merge(hashobj)
+          
+        for mention in tweet.entities['user_mentions']:
+            mentionobj = Mention(tweet, mention)
+            session.merge(mentionobj)
+          
+        for url in tweet.entities['urls']:
+            urlobj = URLData(tweet, url)
+            session.merge(urlobj)
+          
+        if tweet.geo is not None:
+            geotagobj = Geotag(tweet)
+            session.merge(geotagobj)
+                
+        if (get_images) and ('media' in tweet.entities):
+            for idx, media in enumerate(tweet.entities['media']):
+                if 'rawdata' in media and media['rawdata'] is None:
+                    # the pipeline's download failed
+                    continue
+                mediaobj = Media(tweet, media, idx, image_path, https)
+                session.merge(mediaobj)
+
+        if commit:
+            session.commit()
+
+        # process words inside the tweet's body
+        words = tweet_words(tweet.text)
+        for word in words:
+            wordobj = TweetWord(tweet.id, word, session, tweet.created_at)
+            session.merge(wordobj)
+        
+        if commit:
+            session.commit()
+        
+
+    else:
+        tweetobj = thisTweet.one()
+        tweetobj.update(tweet)
+        session.add(tweetobj)
+        if commit:
+            session.commit()
+
+
+class DroppedTweets(Exception):
+    '''
+    Raised by add_tweets when some tweets still couldn't be written after
+    the one at a time fallback; the rest of the batch was committed.
+    '''
+
+    def __init__(self, tweets, error):
+        Exception.__init__(self, '%d tweets could not be written: %s'
+                           % (len(tweets), str(error)))
+        self.tweets = tweets
+        self.error = error
+
+
+def add_tweets(tweets, session, get_images=False, image_path=None,
+               https=None):
+    '''
+    Batched writer: adds a page of tweets (and their authors) with a single
+    commit.  If the batch collides with a concurrent writer we fall back to
+    adding the tweets one at a time, trying each twice since the collision
+    may have been a lexicon insert the other writer has since committed.
+    Tweets failing both tries are logged and raised as DroppedTweets once
+    the others are written.
+    '''
+    try:
+        for tweet in tweets:
+            add_user(tweet.author, session, commit=False)
+            add_tweet(tweet, session, get_images, image_path, https,
+                      commit=False)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        dropped = []
+        for tweet in tweets:
+            for attempt in range(2):
+                try:
+                    add_user(tweet.author, session)
+                    add_tweet(tweet, session, get_images, image_path, https)
+                    break
+                except IntegrityError as e:
+                    session.rollback()
+            else:
+                log.error('Dropping tweet %s: %s' % (tweet.id, str(e)))
+                dropped.append(tweet)
+        if len(dropped) > 0:
+            raise DroppedTweets(dropped, e)
+
+
+def add_user(user, session, commit=True):
+    if session.query(User).filter(User.userid == user.id).count() == 0:
+        userobj = User(user, session)
+        session.add(userobj)
+    else:
+        userobj = session.query(User).filter(User.userid == user.id).one()
+        userobj.update(user, session)
+        session.add(userobj)
+    if commit:
+        session.commit()
+          
+
+def keep_language(lang, languages):
+    '''
+    True if tweets of language lang should be logged under the configured
+    languages (settings: langs, where 'ALL' keeps everything).
+    '''
+    if any('ALL' in s.upper() for s in languages):
+        return True
+    # some tweets come without a language
+    return lang is not None and any(lang in s for s in languages)
+
+
+# class tweet_consumer(threading.Thread):
+class tweet_consumer(Process):
+    '''
+    This class manages the queue of tweets waiting to be added to the
+    SQL database
+    '''
+
+    def __init__(self, queue, parmdata, name=None):
+        # initialize the thread
+
+        Process.__init__(self, name=name)
+        
+        log.info("Starting new tweet consumer.")
+ 
+        # this is meant to be a daemon process, exiting when the program closes
+        self.daemon = True
+
+        # update the log from this thread at this interval
+        self.log_interval = parmdata['settings']['log_interval']
+ 
+        # sessions (and the engine under them) are only opened on first
+        # use, i.e. in the forked process
+        self.sessions = PartitionedSessions(parmdata, get_sql_session)
+
+        # set the queue to pull tweets from
+        self.queue = queue
+        '''
+        twitter's stream filtering for languages is currently (March 2015)
+        broken (you need to have a search term in addition to a language
+        in order to filter), but we want the full stream so we'll do the
+        language filter ourselves
+        '''
+        self.languages = parmdata['settings']['langs']
+        for lang in self.languages:
+            log.info('Logging tweets of language \'%s\'.' % lang)
+
+        # set up whether we're getting tweeted images or not
+        self.get_images = parmdata['settings']['get_images']
+        log.info('Logging image file data is set to \'%s\'.' % self.get_images)
+
+        self.image_path = None
+        if parmdata['settings']['image_storage']['method'].upper() == 'FILE':
+            self.image_path = parmdata['settings']['image_storage']['path']
+            if self.get_images:
+                log.info('Image data being stored on filesystem at \'%s\''
+                         % self.image_path)
+        
+        # some diagnostic variables
+        self.last_time = dt.now()
+        self.n_tweets = 0
+        self.n_dupes = 0
+
+    def run(self):
+        # open https pool for grabbing url data (only needed for images,
+        # so urllib3/certifi aren't imported until the consumer starts)
+        self.https = None
+        if self.get_images:
+            import urllib3
+            import certifi
+            self.https = urllib3.PoolManager(cert_reqs="CERT_REQUIRED",
+                                             ca_certs=certifi.where())
+
+        while True:
+            status = self.queue.get()
+            if keep_language(status.lang, self.languages):
+                '''
+                There is a small chance that two threads will try
+                to add the same user concurrently. This try statement
+                serves to get arround the sqlalchemy IntegrityError
+                which would result
+                '''
+                session = None
+                try:
+                    session = self.sessions.get(status.created_at)
+                    add_user(status.author, session)
+                    add_tweet(status, session, self.get_images,
+                              self.image_path, self.https)
+                    self.n_tweets += 1
+                except IntegrityError:
+                    self.n_dupes += 1
+                    if session is not None:
+                        session.rollback()
+                    pass
+                except:
+                    raise
+            self.status_update()
+
+    def status_update(self):
+        '''
+        Method for keeping track of the rate at which each tweet consumer is
+        processing the queue
+        '''
+        elapsed_time = (dt.now() - self.last_time).total_seconds()
+        if elapsed_time > self.log_interval:
+            log.info("Consuming %f tweets/second (%f/sec discarded as duplicates)." %
+                     (self.n_tweets/elapsed_time, self.n_dupes/elapsed_time))
+            log.info("Reporting %d tweets remaining in queue." %
+                     self.queue.qsize())
+            log_pool_status()
+            self.last_time = dt.now()
+            self.n_tweets = 0
+            self.n_dupes = 0
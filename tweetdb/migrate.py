@@ -0,0 +1,172 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Schema migrations for existing tweet databases."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import logging
+import sqlalchemy as sa
+from models import Base, LangLexicon, SourceLexicon, PlaceLexicon, \
+    TimezoneLexicon
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+# (table, key column, free text column, encoded column, lexicon)
+ENCODED_COLUMNS = [('Tweet', 'tweetid', 'lang', 'langid', LangLexicon),
+                   ('Tweet', 'tweetid', 'source', 'sourceid', SourceLexicon),
+                   ('Tweet', 'tweetid', 'place', 'placeid', PlaceLexicon),
+                   ('User', 'userid', 'timezone', 'timezoneid',
+                    TimezoneLexicon)]
+
+
+def key_chunks(conn, table, key, chunksize):
+    '''
+    Generator yielding (lo, hi] key ranges of at most chunksize rows, read
+    one range at a time so the table is never materialized.
+    '''
+    lo = conn.execute(sa.text('SELECT MIN(%s) - 1 FROM %s' %
+                              (key, table))).scalar()
+    if lo is None:
+        return
+    nextHi = sa.text('SELECT MAX(k) FROM (SELECT %s AS k FROM %s '
+                     'WHERE %s > :lo ORDER BY %s LIMIT :n) AS chunk' %
+                     (key, table, key, key))
+    while True:
+        hi = conn.execute(nextHi, lo=lo, n=chunksize).scalar()
+        if hi is None:
+            return
+        yield lo, hi
+        lo = hi
+
+
+def encode_column(engine, table, key, column, encoded, lexicon,
+                  chunksize=50000):
+    '''
+    Replace a free text column with an id into a lexicon table.  Rows are
+    converted in key ranges of chunksize, each in its own transaction, and
+    rows which already have an id are skipped so the migration can be
+    re-run after an interruption.
+    '''
+    inspector = sa.inspect(engine)
+    columns = [c['name'] for c in inspector.get_columns(table)]
+    if column not in columns:
+        log.info('%s.%s already encoded.' % (table, column))
+        return
+
+    quote = engine.dialect.identifier_preparer.quote
+    lextable = lexicon.__table__.name
+    lexid = lexicon.id.property.columns[0].name
+    lextext = lexicon.text.property.columns[0].name
+    names = dict(table=quote(table), key=quote(key), column=quote(column),
+                 encoded=quote(encoded), lextable=quote(lextable),
+                 lexid=quote(lexid), lextext=quote(lextext))
+
+    conn = engine.connect()
+    if encoded not in columns:
+        conn.execute(sa.text('ALTER TABLE %(table)s ADD COLUMN %(encoded)s '
+                             'INTEGER' % names))
+
+    addText = sa.text(
+        'INSERT INTO %(lextable)s (%(lextext)s) '
+        'SELECT DISTINCT t.%(column)s FROM %(table)s t '
+        'WHERE t.%(key)s > :lo AND t.%(key)s <= :hi '
+        'AND t.%(column)s IS NOT NULL AND t.%(encoded)s IS NULL '
+        'AND NOT EXISTS (SELECT 1 FROM %(lextable)s l '
+        'WHERE l.%(lextext)s = t.%(column)s)' % names)
+    setIds = sa.text(
+        'UPDATE %(table)s SET %(encoded)s = '
+        '(SELECT l.%(lexid)s FROM %(lextable)s l '
+        'WHERE l.%(lextext)s = %(table)s.%(column)s) '
+        'WHERE %(key)s > :lo AND %(key)s <= :hi '
+        'AND %(column)s IS NOT NULL AND %(encoded)s IS NULL' % names)
+
+    nrows = 0
+    for lo, hi in key_chunks(conn, names['table'], names['key'], chunksize):
+        trans = conn.begin()
+        try:
+            conn.execute(addText, lo=lo, hi=hi)
+            nrows += conn.execute(setIds, lo=lo, hi=hi).rowcount
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        log.info('Encoded %s.%s through %s=%s (%d rows).' %
+                 (table, column, key, hi, nrows))
+
+    # index the new column, then retire the old column and its index
+    for index in Base.metadata.tables[table].indexes:
+        if encoded in index.columns and index.name not in \
+           [i['name'] for i in inspector.get_indexes(table)]:
+            index.create(bind=conn)
+    conn.execute(sa.text('DROP INDEX IF EXISTS %s' %
+                         quote('ix_%s_%s' % (table, column))))
+    try:
+        conn.execute(sa.text('ALTER TABLE %(table)s DROP COLUMN %(column)s'
+                             % names))
+    except sa.exc.OperationalError as e:
+        # older SQLite versions can't drop columns; the text is left behind
+        # unindexed and unused
+        log.warning('Could not drop %s.%s: %s' % (table, column, str(e)))
+    conn.close()
+
+
+def encode_columns(engine, chunksize=50000):
+    '''
+    Dictionary encode Tweet.lang, Tweet.source, Tweet.place and
+    User.timezone in an existing database.  Ingest should be stopped while
+    this runs.
+    '''
+    Base.metadata.create_all(engine, tables=[lexicon.__table__ for
+                                             _, _, _, _, lexicon in
+                                             ENCODED_COLUMNS])
+    for table, key, column, encoded, lexicon in ENCODED_COLUMNS:
+        encode_column(engine, table, key, column, encoded, lexicon,
+                      chunksize)
+
+
+# (table, key column) for the tables partitioned alongside Tweet
+DATED_TABLES = [('Hashtag', 'hashid'), ('Mention', 'mentionid'),
+                ('URLData', 'urlid'), ('Geotag', 'geoid'),
+                ('TweetWord', 'id')]
+
+
+def add_child_dates(engine, chunksize=50000):
+    '''
+    Copy Tweet.date onto the rows of its child tables in an existing
+    database, in key-range chunks like encode_column.
+    '''
+    inspector = sa.inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    conn = engine.connect()
+    for table, key in DATED_TABLES:
+        names = dict(table=quote(table), key=quote(key),
+                     datetype=sa.DateTime().compile(dialect=engine.dialect))
+        if 'date' not in [c['name'] for c in inspector.get_columns(table)]:
+            conn.execute(sa.text('ALTER TABLE %(table)s ADD COLUMN date '
+                                 '%(datetype)s' % names))
+        setDates = sa.text(
+            'UPDATE %(table)s SET date = (SELECT t.date FROM "Tweet" t '
+            'WHERE t.tweetid = %(table)s.tweetid) '
+            'WHERE %(key)s > :lo AND %(key)s <= :hi AND date IS NULL'
+            % names)
+        nrows = 0
+        for lo, hi in key_chunks(conn, names['table'], names['key'],
+                                 chunksize):
+            trans = conn.begin()
+            try:
+                nrows += conn.execute(setDates, lo=lo, hi=hi).rowcount
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+            log.info('Dated %s through %s=%s (%d rows).' %
+                     (table, key, hi, nrows))
+        for index in Base.metadata.tables[table].indexes:
+            if 'date' in index.columns and index.name not in \
+               [i['name'] for i in inspector.get_indexes(table)]:
+                index.create(bind=conn)
+    conn.close()
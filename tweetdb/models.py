@@ -0,0 +1,450 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "SQLAlchemy models for tweets stored in a relational database."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import zlib
+import md5
+import os
+from datetime import datetime as dt
+from sqlalchemy import ForeignKey
+from sqlalchemy import Column, DateTime, Integer, String, Boolean, BigInteger, \
+    Float, Binary
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import event
+from sqlalchemy.orm import relationship, Session
+from sqlalchemy.exc import IntegrityError
+
+
+# set up the sql base
+Base = declarative_base()
+
+# in-process caches of text -> id for the dictionary lexicons, keyed by
+# (database url, table name)
+lexicon_cache = {}
+
+
+@event.listens_for(Session, 'after_commit')
+def _cache_lexicon_ids(session):
+    # ids looked up or inserted by this transaction are safe to share now
+    pending = session.info.pop('lexicon_ids', {})
+    for (key, text), lexid in pending.items():
+        lexicon_cache.setdefault(key, {})[text] = lexid
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_lexicon_ids(session):
+    # rows inserted by the rolled back transaction (or savepoint) are gone
+    session.info.pop('lexicon_ids', None)
+
+
+def add_lexicon_row(session, lexobj, lookup):
+    '''
+    Insert a new lexicon row and return it.  Another writer may insert the
+    same text first.  Where savepoints work the insert gets its own, so
+    losing that race only rolls back the savepoint and lookup() reads back
+    the winner's row, leaving the rest of the transaction alone.  pysqlite
+    can't open savepoints inside our transactions, so on SQLite the
+    IntegrityError is left for the caller to roll back and retry.
+    '''
+    if session.get_bind().dialect.name == 'sqlite':
+        lexobj = session.merge(lexobj)
+        session.flush()
+        return lexobj
+    try:
+        with session.begin_nested():
+            lexobj = session.merge(lexobj)
+            session.flush()
+        return lexobj
+    except IntegrityError:
+        existing = lookup()
+        if existing is None:
+            raise
+        return existing
+
+
+def lexicon_id(session, lexicon, text):
+    '''
+    Returns the id of text in one of the dictionary lexicons (LangLexicon,
+    SourceLexicon, PlaceLexicon, TimezoneLexicon), adding it if we haven't
+    seen it before.  Ids are kept with the session until its transaction
+    commits and only then shared through lexicon_cache, so a rolled back
+    insert never leaves a stale id behind.
+    '''
+    if text is None:
+        return None
+    key = (str(session.get_bind().url), lexicon.__tablename__)
+    if text in lexicon_cache.get(key, {}):
+        return lexicon_cache[key][text]
+    pending = session.info.setdefault('lexicon_ids', {})
+    if (key, text) in pending:
+        return pending[(key, text)]
+    lookup = session.query(lexicon).filter(lexicon.text == text).one_or_none
+    lexobj = lookup()
+    if lexobj is None:
+        lexobj = add_lexicon_row(session, lexicon(text), lookup)
+    # add_lexicon_row may have rolled back a savepoint, which clears the
+    # pending ids
+    session.info.setdefault('lexicon_ids', {})[(key, text)] = lexobj.id
+    return lexobj.id
+
+
+class Hashtag(Base):
+    """Hashtag Data"""
+    __tablename__ = "Hashtag"
+    hashid = Column('hashid', Integer, primary_key=True)
+    tweetid = Column('tweetid', BigInteger, ForeignKey("Tweet.tweetid"),
+                     unique=False, index=True)
+    hashtagid = Column('hashtagid', Integer, ForeignKey("HashtagLexicon.hashtagid"),
+                       unique=False, index=True)
+    date = Column('date', DateTime, index=True)
+        
+    def __init__(self, tweet, tag, session):
+        # check if the hashtag is already in the lexicon
+        lookup = session.query(HashtagLexicon).\
+            filter(HashtagLexicon.hashtagtext == tag['text']).one_or_none
+        lexobj = lookup()
+        if lexobj is None:
+            lexobj = add_lexicon_row(session, HashtagLexicon(tag), lookup)
+        self.tweetid = tweet.id
+        self.hashtagid = lexobj.hashtagid
+        self.date = tweet.created_at
+
+
+class HashtagLexicon(Base):
+    """Hashtag Text"""
+    __tablename__ = "HashtagLexicon"
+    hashtagid = Column('hashtagid', Integer, unique=True, primary_key=True,
+                       index=True)
+    hashtagtext = Column('hashtagtext', String, index=True, unique=True)
+
+    def __init__(self, tag):
+        self.hashtagtext = tag['text']
+
+
+class TweetLexicon(Base):
+    """Tweet Text"""
+    __tablename__ = "TweetLexicon"
+    wordid = Column('wordid', Integer, unique=True, primary_key=True,
+                       index=True)
+    wordtext = Column('wordtext', String, index=True, unique=True)
+
+    def __init__(self, word):
+        self.wordtext = word
+
+
+class LangLexicon(Base):
+    """Tweet Language Codes"""
+    __tablename__ = "LangLexicon"
+    id = Column('langid', Integer, unique=True, primary_key=True, index=True)
+    text = Column('langtext', String, index=True, unique=True)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class SourceLexicon(Base):
+    """Tweet Source (Client) Text"""
+    __tablename__ = "SourceLexicon"
+    id = Column('sourceid', Integer, unique=True, primary_key=True,
+                index=True)
+    text = Column('sourcetext', String, index=True, unique=True)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class PlaceLexicon(Base):
+    """Tweet Place Names"""
+    __tablename__ = "PlaceLexicon"
+    id = Column('placeid', Integer, unique=True, primary_key=True, index=True)
+    text = Column('placetext', String, index=True, unique=True)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class TimezoneLexicon(Base):
+    """User Timezone Names"""
+    __tablename__ = "TimezoneLexicon"
+    id = Column('timezoneid', Integer, unique=True, primary_key=True,
+                index=True)
+    text = Column('timezonetext', String, index=True, unique=True)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class TweetWord(Base):
+    """Tweet Text"""
+    __tablename__ = "TweetWord"
+    id = Column('id', Integer, unique=True, primary_key=True)
+    tweetid = Column('tweetid', BigInteger, ForeignKey("Tweet.tweetid"),
+                     unique=False, index=True)
+    wordid = Column('wordid', Integer, index=True)
+    date = Column('date', DateTime, index=True)
+
+    def __init__(self, tweetid, word, session, date=None):
+        lookup = session.query(TweetLexicon).\
+            filter(TweetLexicon.wordtext == word).one_or_none
+        wordobj = lookup()
+        if wordobj is None:
+            wordobj = add_lexicon_row(session, TweetLexicon(word), lookup)
+        self.tweetid = tweetid
+        self.wordid = wordobj.wordid
+        self.date = date
+
+
+class DailyWordCount(Base):
+    """Per-day Word Counts (compacted TweetWord)"""
+    __tablename__ = "DailyWordCount"
+    day = Column('day', DateTime, primary_key=True)
+    langid = Column('langid', Integer, ForeignKey("LangLexicon.langid"),
+                    primary_key=True)
+    wordid = Column('wordid', Integer, primary_key=True, index=True)
+    count = Column('count', Integer)
+
+
+class DailyHashtagCount(Base):
+    """Per-day Hashtag Counts (compacted Hashtag)"""
+    __tablename__ = "DailyHashtagCount"
+    day = Column('day', DateTime, primary_key=True)
+    langid = Column('langid', Integer, ForeignKey("LangLexicon.langid"),
+                    primary_key=True)
+    hashtagid = Column('hashtagid', Integer,
+                       ForeignKey("HashtagLexicon.hashtagid"),
+                       primary_key=True, index=True)
+    count = Column('count', Integer)
+
+
+class DailyLangCount(Base):
+    """Per-day Tweet Counts by Language (compacted Tweet)"""
+    __tablename__ = "DailyLangCount"
+    day = Column('day', DateTime, primary_key=True)
+    langid = Column('langid', Integer, ForeignKey("LangLexicon.langid"),
+                    primary_key=True)
+    count = Column('count', Integer)
+
+
+class DailyGeoCount(Base):
+    """Per-day Geotag Counts by Grid Cell (compacted Geotag)"""
+    __tablename__ = "DailyGeoCount"
+    day = Column('day', DateTime, primary_key=True)
+    langid = Column('langid', Integer, ForeignKey("LangLexicon.langid"),
+                    primary_key=True)
+    # south west corner of the cell
+    latitude = Column('latitude', Float, primary_key=True)
+    longitude = Column('longitude', Float, primary_key=True)
+    count = Column('count', Integer)
+
+
+class CompactedTweet(Base):
+    """Tweets Archived by Compaction, by Day and Batch"""
+    __tablename__ = "CompactedTweet"
+    day = Column('day', DateTime, primary_key=True)
+    batch = Column('batch', Integer, primary_key=True)
+    tweetid = Column('tweetid', BigInteger, primary_key=True, index=True)
+
+
+class Media(Base):
+    """Binary Media Data"""
+    __tablename__ = "Media"
+    mediaid = Column('mediaid', Integer, primary_key=True)
+    tweetid = Column('tweetid', BigInteger, ForeignKey("Tweet.tweetid"),
+                     unique=False, index=True)
+    blob = Column('blob', Binary, unique=False, nullable=True)
+    native_filename = Column('native_filename', String, unique=False,
+                             nullable=True)
+    local_filename = Column('local_filename', String, unique=False,
+                            nullable=True)
+    
+    def __init__(self, tweet, media, idx, image_path=None, https=None):
+        self.tweetid = tweet.id
+        if 'rawdata' in media:
+            # already fetched by the pipeline's downloader threads
+            rawdata = media['rawdata']
+        else:
+            rawdata = https.request('GET', media['media_url_https']).data
+        extension = os.path.splitext(media['media_url_https'])[1]
+        self.native_filename = os.path.split(media['media_url_https'])[1]
+        if image_path is None:
+            self.blob = zlib.compress(rawdata)
+            self.filename = None
+        else:
+            self.blob = None
+            md5hash = md5.new()
+            md5hash.update(str(tweet.id) + str(idx))
+            hashdata = md5hash.hexdigest()
+            self.local_filename = image_path + os.path.sep + hashdata[0:2] +\
+                                  os.path.sep + hashdata[3:5] + os.path.sep +\
+                                  hashdata[6:8] + os.path.sep + hashdata[9:] \
+                                  + extension
+            if not os.path.exists(os.path.dirname(self.local_filename)):
+                os.makedirs(os.path.dirname(self.local_filename), mode=0777)
+            with open(self.local_filename, 'wb') as f:
+                f.write(rawdata)
+            
+
+class URLData(Base):
+    """URL Data"""
+    __tablename__ = "URLData"
+    urlid = Column('urlid', Integer, primary_key=True)
+    tweetid = Column('tweetid', BigInteger, ForeignKey("Tweet.tweetid"),
+                     unique=False, index=True)
+    url = Column('url', String, unique=False)
+    date = Column('date', DateTime, index=True)
+    
+    def __init__(self, tweet, url):
+        self.tweetid = tweet.id
+        self.url = url['expanded_url']
+        self.date = tweet.created_at
+
+
+class Mention(Base):
+    """User Mention Data"""
+    __tablename__ = "Mention"
+    mentionid = Column('mentionid', Integer, primary_key=True)
+    tweetid = Column('tweetid', BigInteger, ForeignKey("Tweet.tweetid"),
+                     unique=False, index=True)
+    source = Column('source', BigInteger, unique=False, index=True)
+    target = Column('target', BigInteger, unique=False, index=True)
+    date = Column('date', DateTime, index=True)
+    
+    def __init__(self, tweet, mention):
+        self.tweetid = tweet.id
+        self.source = tweet.author.id
+        self.target = mention['id']
+        self.date = tweet.created_at
+ 
+
+class Geotag(Base):
+    """Geotag Data"""
+    __tablename__ = "Geotag"
+    geoid = Column('geoid', Integer, primary_key=True)
+    tweetid = Column('tweetid', BigInteger, ForeignKey("Tweet.tweetid"),
+                     unique=False, index=True)
+    latitude = Column('latitude', Float, unique=False)
+    longitude = Column('longitude', Float, unique=False)
+    date = Column('date', DateTime, index=True)
+    
+    def __init__(self, tweet):
+        self.tweetid = tweet.id
+        self.latitude = tweet.geo['coordinates'][0]
+        self.longitude = tweet.geo['coordinates'][1]
+        self.date = tweet.created_at
+
+
+class Tweet(Base):
+    """Tweet Data"""
+    __tablename__ = "Tweet"
+
+    tweetid = Column(BigInteger, primary_key=True, index=True)
+    userid = Column('userid', BigInteger, ForeignKey("User.userid"), index=True)
+    text = Column('text', String(length=500), nullable=True)
+    placeid = Column('placeid', Integer, ForeignKey("PlaceLexicon.placeid"),
+                     index=True)
+    rtcount = Column('rtcount', Integer)
+    fvcount = Column('fvcount', Integer)
+    langid = Column('langid', Integer, ForeignKey("LangLexicon.langid"),
+                    index=True)
+    date = Column('date', DateTime, index=True)
+    sourceid = Column('sourceid', Integer,
+                      ForeignKey("SourceLexicon.sourceid"), index=True)
+    placelex = relationship(PlaceLexicon)
+    langlex = relationship(LangLexicon)
+    sourcelex = relationship(SourceLexicon)
+    geotags = relationship(Geotag, lazy="dynamic", backref='tweet')
+    hashtags = relationship(Hashtag, lazy="dynamic", backref='tweet')
+    mentions = relationship(Mention, lazy="dynamic", backref='tweet')
+    urls = relationship(URLData, lazy="dynamic",  backref='tweet')
+    media = relationship(Media, lazy="dynamic", backref='tweet')
+
+    def __init__(self, tweet, session):
+        self.tweetid = tweet.id
+        self.userid = tweet.author.id
+        self.text = tweet.text
+        self.rtcount = tweet.retweet_count
+        self.fvcount = tweet.favorite_count
+        self.langid = lexicon_id(session, LangLexicon, tweet.lang)
+        self.date = tweet.created_at
+        self.sourceid = lexicon_id(session, SourceLexicon, tweet.source)
+        if getattr(tweet, 'place', None) is not None:
+            self.placeid = lexicon_id(session, PlaceLexicon,
+                                      tweet.place.full_name)
+
+    @property
+    def lang(self):
+        return self.langlex.text if self.langlex is not None else None
+
+    @property
+    def source(self):
+        return self.sourcelex.text if self.sourcelex is not None else None
+
+    @property
+    def place(self):
+        return self.placelex.text if self.placelex is not None else None
+
+    def update(self, tweet):
+        self.rtcount = tweet.retweet_count
+        self.fvcount = tweet.favorite_count
+  
+
+class User(Base):
+    """Twitter User Data"""
+    __tablename__ = "User"
+
+    userid = Column(BigInteger, primary_key=True, index=True)
+    username = Column('username', String)
+    name = Column('name', String)
+    location = Column('location', String, nullable=True)
+    description = Column('description', String, nullable=True)
+    numfollowers = Column('numfollowers', Integer)
+    numfriends = Column('numfriends', Integer)
+    numtweets = Column('numtweets', Integer)
+    createdat = Column('createdat', DateTime)
+    timezoneid = Column('timezoneid', Integer,
+                        ForeignKey("TimezoneLexicon.timezoneid"))
+    geoloc = Column('geoloc', Boolean)
+    lastupdate = Column('lastupdate', DateTime)
+    verified = Column('verified', Boolean)
+    tweets = relationship(Tweet, lazy="dynamic", backref='user')
+    timezonelex = relationship(TimezoneLexicon)
+
+    def __init__(self, author, session):
+        self.userid = author.id
+        self.username = author.screen_name
+        self.name = author.name
+        self.location = author.location
+        self.description = author.description
+        self.numfollowers = author.followers_count
+        self.numfriends = author.friends_count
+        self.numtweets = author.statuses_count
+        self.createdat = author.created_at
+        self.timezoneid = lexicon_id(session, TimezoneLexicon,
+                                     author.time_zone)
+        self.geoloc = author.geo_enabled
+        self.verified = author.verified
+        self.lastupdate = dt.now()
+
+    def update(self, author, session):
+        self.username = author.screen_name
+        self.name = author.name
+        self.location = author.location
+        self.description = author.description
+        self.numfollowers = author.followers_count
+        self.numfriends = author.friends_count
+        self.numtweets = author.statuses_count
+        self.timezoneid = lexicon_id(session, TimezoneLexicon,
+                                     author.time_zone)
+        self.geoloc = author.geo_enabled
+        self.verified = author.verified
+        self.lastupdate = dt.now()
+
+    @property
+    def timezone(self):
+        return self.timezonelex.text if self.timezonelex is not None \
+            else None
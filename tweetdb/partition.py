@@ -0,0 +1,479 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Time partitioned storage for tweets and their child tables."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+'''
+Tweet and the tables hanging off it are split by Tweet.date into one
+partition per day, week or month (database: partition: period in the YAML
+parameter file).
+
+On Postgres we use native declarative partitioning: each table is created
+PARTITION BY RANGE (date) and the planner prunes partitions from any query
+with a date range on that table.  That's why the child tables carry their
+tweet's date as well.
+
+On SQLite each period lives in its own database file under
+database: partition: path, holding all of the partitioned tables, while
+db_host keeps everything else.  Writers open the period file as the main
+database and attach db_host, so unqualified table names resolve to the
+period's Tweet tables and the shared User and lexicon tables alike.
+Readers open db_host and prune() attaches only the period files overlapping
+the query, hiding them behind temporary views named after the tables.
+
+Either way, retention drops (or archives) whole partitions.
+'''
+
+import logging
+import os
+import re
+import shutil
+from datetime import datetime as dt
+from datetime import timedelta
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateIndex
+from models import Base
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+# tables split by Tweet.date
+PARTITIONED = ['Tweet', 'Hashtag', 'Mention', 'URLData', 'Geotag',
+               'TweetWord']
+
+PERIODS = ['day', 'week', 'month']
+
+# partitions are named after the first day of their period
+PARTITION_NAME = re.compile(r'^p(\d{8})$')
+
+# alias prefix for period files attached by readers
+ATTACH_PREFIX = 'part_'
+
+# SQLite refuses to attach more than this many databases by default
+MAX_ATTACHED = 10
+
+# Postgres advisory lock key serializing partition creation
+PARTITION_LOCK = 0x74776462
+
+
+def partition_settings(parmdata):
+    '''
+    Returns the database: partition block of the parameter file with its
+    period validated, or None if the database isn't partitioned.
+    '''
+    settings = parmdata['database'].get('partition')
+    if settings is None or str(settings.get('period', 'none')).lower() \
+       == 'none':
+        return None
+    if settings['period'].lower() not in PERIODS:
+        raise ValueError('Unknown partition period \'%s\' (expected one of '
+                         '%s).' % (settings['period'], ', '.join(PERIODS)))
+    return settings
+
+
+def period_start(when, period):
+    day = dt(when.year, when.month, when.day)
+    if period == 'day':
+        return day
+    elif period == 'week':
+        return day - timedelta(days=day.weekday())
+    return dt(when.year, when.month, 1)
+
+
+def period_end(start, period):
+    if period == 'day':
+        return start + timedelta(days=1)
+    elif period == 'week':
+        return start + timedelta(days=7)
+    elif start.month == 12:
+        return dt(start.year + 1, 1, 1)
+    return dt(start.year, start.month + 1, 1)
+
+
+def period_starts(start, stop, period):
+    '''
+    Returns the start of every period overlapping [start, stop].
+    '''
+    starts = []
+    current = period_start(start, period)
+    while current <= stop:
+        starts.append(current)
+        current = period_end(current, period)
+    return starts
+
+
+def partition_name(start):
+    return 'p' + start.strftime('%Y%m%d')
+
+
+def partition_start(name):
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    return dt.strptime(match.group(1), '%Y%m%d')
+
+
+def partition_file(settings, start):
+    return os.path.join(settings['path'], partition_name(start) + '.db')
+
+
+###########################################################
+#               Postgres Declarative Partitions
+###########################################################
+
+
+def _table_ddl(table, dialect, partitioned):
+    '''
+    CREATE TABLE for a table under Postgres partitioning.  Partitioned
+    tables get date added to their primary key (Postgres requires the
+    partition key in every unique constraint) and foreign keys into
+    partitioned tables are left out, since there's no longer a unique
+    tweetid to reference.
+    '''
+    quote = dialect.identifier_preparer.quote
+    lines = []
+    for column in table.columns:
+        if column.primary_key and type(column.type) is sa.Integer:
+            coltype = 'SERIAL'
+        else:
+            coltype = column.type.compile(dialect=dialect)
+        lines.append('%s %s%s' % (quote(column.name), coltype,
+                                  '' if column.nullable else ' NOT NULL'))
+    keys = [c.name for c in table.primary_key.columns]
+    if partitioned:
+        keys.append('date')
+    lines.append('PRIMARY KEY (%s)' % ', '.join(quote(k) for k in keys))
+    for fk in table.foreign_keys:
+        if fk.column.table.name in PARTITIONED:
+            continue
+        lines.append('FOREIGN KEY (%s) REFERENCES %s (%s)' %
+                     (quote(fk.parent.name), quote(fk.column.table.name),
+                      quote(fk.column.name)))
+    ddl = 'CREATE TABLE IF NOT EXISTS %s (\n\t%s\n)' % \
+          (quote(table.name), ',\n\t'.join(lines))
+    if partitioned:
+        ddl += ' PARTITION BY RANGE (date)'
+    return ddl
+
+
+def create_postgres_tables(engine):
+    '''
+    Create the schema with the Tweet tables partitioned by date.  Tables
+    which don't reference a partitioned table are left to create_all.
+    '''
+    custom = [t for t in Base.metadata.sorted_tables
+              if t.name in PARTITIONED or
+              any(fk.column.table.name in PARTITIONED
+                  for fk in t.foreign_keys)]
+    Base.metadata.create_all(engine, tables=[t for t in
+                                             Base.metadata.sorted_tables
+                                             if t not in custom])
+    conn = engine.connect()
+    for table in custom:
+        if engine.has_table(table.name):
+            continue
+        conn.execute(sa.text(_table_ddl(table, engine.dialect,
+                                        table.name in PARTITIONED)))
+        for index in table.indexes:
+            conn.execute(CreateIndex(index))
+    conn.close()
+
+
+def ensure_postgres_partitions(engine, starts, period):
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        # two writers running CREATE TABLE IF NOT EXISTS for a new period at
+        # once can still collide in the catalog, so take turns
+        conn.execute(sa.text('SELECT pg_advisory_xact_lock(:key)'),
+                     key=PARTITION_LOCK)
+        for start in starts:
+            for table in PARTITIONED:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS %s PARTITION OF %s '
+                    'FOR VALUES FROM (\'%s\') TO (\'%s\')' %
+                    (quote('%s_%s' % (table, partition_name(start))),
+                     quote(table), start.strftime('%Y-%m-%d'),
+                     period_end(start, period).strftime('%Y-%m-%d')))
+
+
+def postgres_partitions(engine):
+    '''
+    Returns {period start: partition name suffix} for every partition of
+    Tweet.
+    '''
+    rows = engine.execute(sa.text(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent '
+        'WHERE p.relname = :parent'), parent='Tweet').fetchall()
+    partitions = {}
+    for row in rows:
+        name = row[0][len('Tweet_'):]
+        if partition_start(name) is not None:
+            partitions[partition_start(name)] = name
+    return partitions
+
+
+###########################################################
+#               SQLite Per-Period Database Files
+###########################################################
+
+
+def sqlite_partition_engine(parmdata, start):
+    '''
+    Engine writing into the period file for start, with db_host attached
+    as "shared" so User and the lexicons are visible too.  Engines come
+    from the database module's registry, so each process opens (and
+    creates the tables in) a period file once and its pool shows up in
+    pool_status().
+    '''
+    # database imports this module, so import it when first needed
+    from database import get_engine
+    settings = partition_settings(parmdata)
+    if not os.path.exists(settings['path']):
+        os.makedirs(settings['path'])
+    shared = parmdata['database']['db_host']
+
+    def setup(engine):
+        @sa.event.listens_for(engine, 'connect')
+        def attach_shared(dbapi_connection, connection_record):
+            dbapi_connection.execute('ATTACH DATABASE ? AS shared',
+                                     (shared,))
+
+        Base.metadata.create_all(engine, tables=[Base.metadata.tables[t]
+                                                 for t in PARTITIONED])
+
+    return get_engine('sqlite:///' + partition_file(settings, start),
+                      setup=setup)
+
+
+def sqlite_partitions(settings):
+    '''
+    Returns {period start: file name} for every period file on disk.
+    '''
+    partitions = {}
+    if not os.path.exists(settings['path']):
+        return partitions
+    for filename in os.listdir(settings['path']):
+        name, extension = os.path.splitext(filename)
+        if extension == '.db' and partition_start(name) is not None:
+            partitions[partition_start(name)] = filename
+    return partitions
+
+
+def prune(session, parmdata, start, stop=None):
+    '''
+    Limit the partitioned tables seen by session to the partitions
+    overlapping [start, stop].  Only SQLite needs help here; Postgres prunes
+    on its own given a date range.  A start of None means the oldest
+    partition; either way at most MAX_ATTACHED partitions can be seen at
+    once, so long windows should be read a partition at a time (see
+    id_ranges).
+    '''
+    settings = partition_settings(parmdata)
+    if settings is None or \
+       parmdata['database']['db_type'].upper() != 'SQLITE':
+        return
+    if stop is None:
+        stop = dt.utcnow()
+    period = settings['period'].lower()
+    files = sqlite_partitions(settings)
+    if start is None:
+        start = min(files) if len(files) > 0 else stop
+    starts = [s for s in period_starts(start, stop, period) if s in files]
+    if len(starts) > MAX_ATTACHED:
+        raise ValueError('Query spans %d partitions but SQLite can only '
+                         'attach %d; narrow the time range or use a longer '
+                         'partition period.' % (len(starts), MAX_ATTACHED))
+
+    conn = session.connection()
+    quote = conn.dialect.identifier_preparer.quote
+    for table in PARTITIONED:
+        conn.execute('DROP VIEW IF EXISTS temp.%s' % quote(table))
+    for row in conn.execute('PRAGMA database_list').fetchall():
+        if row[1].startswith(ATTACH_PREFIX):
+            conn.execute('DETACH DATABASE %s' % quote(row[1]))
+
+    aliases = []
+    for periodstart in starts:
+        alias = ATTACH_PREFIX + partition_name(periodstart)
+        conn.execute(sa.text('ATTACH DATABASE :path AS %s' % quote(alias)),
+                     path=os.path.join(settings['path'], files[periodstart]))
+        aliases.append(alias)
+
+    for table in PARTITIONED:
+        columns = Base.metadata.tables[table].columns
+        if len(aliases) > 0:
+            select = ' UNION ALL '.join(
+                'SELECT * FROM %s.%s' % (quote(alias), quote(table))
+                for alias in aliases)
+        else:
+            # no data in range, but the queries still need the columns
+            select = 'SELECT %s WHERE 0' % \
+                ', '.join('NULL AS %s' % quote(c.name) for c in columns)
+        conn.execute('CREATE TEMP VIEW %s AS %s' % (quote(table), select))
+
+
+def id_ranges(parmdata, start=None, stop=None):
+    '''
+    Returns [(lo, hi), ...] date ranges within which row ids are unique.
+    Each SQLite period file numbers its rows from 1, so ids repeat behind
+    prune()'s views and anything paging or keeping a watermark on an id
+    has to do so per period file overlapping [start, stop].  Elsewhere the
+    ids are unique across the whole table, given as [(None, None)].
+    '''
+    settings = partition_settings(parmdata)
+    if settings is None or \
+       parmdata['database']['db_type'].upper() != 'SQLITE':
+        return [(None, None)]
+    period = settings['period'].lower()
+    ranges = []
+    for periodstart in sorted(sqlite_partitions(settings)):
+        periodstop = period_end(periodstart, period)
+        if (start is None or periodstop > start) and \
+           (stop is None or periodstart <= stop):
+            ranges.append((periodstart, periodstop))
+    return ranges
+
+
+###########################################################
+#                     Writing and Retention
+###########################################################
+
+
+class PartitionedSessions(object):
+    '''
+    Hands out the session a tweet created at a given time should be written
+    with, creating partitions as they're needed.  Unpartitioned databases
+    just get the one session.
+    '''
+
+    def __init__(self, parmdata, get_session):
+        self.parmdata = parmdata
+        self.get_session = get_session
+        self.settings = partition_settings(parmdata)
+        self.sqlite = parmdata['database']['db_type'].upper() == 'SQLITE'
+        self.session = None
+        self.known = set()
+        self.sessions = {}
+
+    def period(self, when):
+        '''
+        Start of the partition a tweet created at when belongs in, None if
+        the database isn't partitioned.
+        '''
+        if self.settings is None:
+            return None
+        return period_start(when, self.settings['period'].lower())
+
+    def get(self, when):
+        if self.settings is None:
+            if self.session is None:
+                self.session = self.get_session(self.parmdata)
+            return self.session
+
+        period = self.settings['period'].lower()
+        start = self.period(when)
+        if self.sqlite:
+            if start not in self.sessions:
+                engine = sqlite_partition_engine(self.parmdata, start)
+                self.sessions[start] = sessionmaker(bind=engine)()
+            return self.sessions[start]
+
+        if self.session is None:
+            self.session = self.get_session(self.parmdata)
+        if start not in self.known:
+            ensure_postgres_partitions(self.session.get_bind(), [start],
+                                       period)
+            self.known.add(start)
+        return self.session
+
+    def close(self):
+        # the engines stay in the database module's registry for reuse
+        for session in [self.session] + self.sessions.values():
+            if session is not None:
+                session.close()
+        self.session = None
+        self.sessions = {}
+
+
+def retention_cutoff(now, period, keep):
+    '''
+    Start of the oldest period to keep when retaining `keep` periods
+    (counting the current one).
+    '''
+    cutoff = period_start(now, period)
+    for i in range(keep - 1):
+        cutoff = period_start(cutoff - timedelta(days=1), period)
+    return cutoff
+
+
+def create_partitions(parmdata, engine, start, stop):
+    '''
+    Create the partitions covering [start, stop] ahead of time.
+    '''
+    settings = partition_settings(parmdata)
+    if settings is None:
+        raise ValueError('Database is not partitioned.')
+    period = settings['period'].lower()
+    starts = period_starts(start, stop, period)
+    if parmdata['database']['db_type'].upper() == 'SQLITE':
+        for periodstart in starts:
+            sqlite_partition_engine(parmdata, periodstart).dispose()
+    else:
+        ensure_postgres_partitions(engine, starts, period)
+
+
+def retire_partitions(parmdata, engine, before, archive=False):
+    '''
+    Remove every partition whose period ends on or before `before`.  With
+    archive, Postgres partitions are detached into standalone tables and
+    SQLite period files are moved to database: partition: archive_path
+    instead of being dropped.
+    '''
+    from database import dispose_engine
+    settings = partition_settings(parmdata)
+    if settings is None:
+        raise ValueError('Database is not partitioned.')
+    period = settings['period'].lower()
+
+    if parmdata['database']['db_type'].upper() == 'SQLITE':
+        for start, filename in sorted(sqlite_partitions(settings).items()):
+            if period_end(start, period) > before:
+                continue
+            path = os.path.join(settings['path'], filename)
+            # a later write to this period must start a fresh file
+            dispose_engine('sqlite:///' + path)
+            if archive:
+                log.info('Archiving partition %s.' % filename)
+                if not os.path.exists(settings['archive_path']):
+                    os.makedirs(settings['archive_path'])
+                shutil.move(path, os.path.join(settings['archive_path'],
+                                               filename))
+            else:
+                log.info('Dropping partition %s.' % filename)
+                os.remove(path)
+        return
+
+    quote = engine.dialect.identifier_preparer.quote
+    for start, name in sorted(postgres_partitions(engine).items()):
+        if period_end(start, period) > before:
+            continue
+        conn = engine.connect()
+        trans = conn.begin()
+        for table in PARTITIONED:
+            partition = quote('%s_%s' % (table, name))
+            if archive:
+                log.info('Detaching partition %s.' % partition)
+                conn.execute('ALTER TABLE %s DETACH PARTITION %s' %
+                             (quote(table), partition))
+            else:
+                log.info('Dropping partition %s.' % partition)
+                conn.execute('DROP TABLE %s' % partition)
+        trans.commit()
+        conn.close()
@@ -0,0 +1,218 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Single process ingest pipeline."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+'''
+The default pipeline runs every tweet_producer and tweet_consumer as its
+own process, each with its own database session and HTTPS pool, although
+they spend nearly all of their time waiting on the network or the
+database.  single_process_pipeline runs the same stages as threads of one
+process joined by bounded queues:
+
+  tweet_reader(s) -> dispatcher -> downloaders (images only) -> writer
+
+The dispatcher does the language filtering, the downloaders fetch tweeted
+images over one shared HTTPS pool, and a single writer thread commits
+tweets to the database in batches with the batched writer.
+'''
+
+import logging
+import threading
+from Queue import Queue, Empty
+from datetime import datetime as dt
+from database import get_sql_session, log_pool_status
+from partition import PartitionedSessions
+from ingest import add_tweets, keep_language, DroppedTweets
+from twitter import tweet_reader
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+
+class single_process_pipeline(object):
+    def __init__(self, auth, parmdata):
+        settings = parmdata['settings']
+        self.parmdata = parmdata
+        self.languages = settings['langs']
+        self.log_interval = settings['log_interval']
+        self.get_images = settings['get_images']
+        self.image_path = None
+        if settings['image_storage']['method'].upper() == 'FILE':
+            self.image_path = settings['image_storage']['path']
+        self.batch_size = settings.get('batch_size', 50)
+        channel_size = settings.get('channel_size', 100)
+        num_downloaders = settings.get('num_downloaders', 4) \
+            if self.get_images else 0
+
+        # bounded channels between the stages
+        self.stream_queue = Queue(channel_size)
+        self.media_queue = Queue(channel_size)
+        self.write_queue = Queue(channel_size)
+
+        self.https = None
+        if self.get_images:
+            import urllib3
+            import certifi
+            self.https = urllib3.PoolManager(cert_reqs="CERT_REQUIRED",
+                                             ca_certs=certifi.where(),
+                                             maxsize=num_downloaders)
+
+        self.readers = [tweet_reader(auth, self.stream_queue, parmdata,
+                                     name="reader_%d" % i)
+                        for i in range(settings.get('num_producers', 1))]
+        self.dispatcher = self._thread(self.dispatch, "dispatcher")
+        self.downloaders = [self._thread(self.download, "downloader_%d" % i)
+                            for i in range(num_downloaders)]
+        self.writer = self._thread(self.write, "writer")
+
+        # some diagnostic variables
+        self.last_time = dt.now()
+        self.n_tweets = 0
+        self.n_failed = 0
+
+    def _thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        return thread
+
+    def start(self):
+        log.info("Starting single process pipeline.")
+        for thread in [self.writer] + self.downloaders + [self.dispatcher] \
+                + self.readers:
+            thread.start()
+
+    def close(self):
+        '''
+        Disconnect the stream and let everything already read drain through
+        to the database.
+        '''
+        for reader in self.readers:
+            reader.close()
+        self.stream_queue.put(None)
+        self.dispatcher.join()
+        self.writer.join()
+
+    def dispatch(self):
+        while True:
+            status = self.stream_queue.get()
+            if status is None:
+                break
+            try:
+                if not keep_language(status.lang, self.languages):
+                    continue
+                if self.get_images and 'media' in status.entities:
+                    self.media_queue.put(status)
+                else:
+                    self.write_queue.put(status)
+            except Exception:
+                # one odd tweet mustn't stop the dispatcher
+                log.exception('Dispatching a tweet failed.')
+
+        # shut the later stages down in order
+        for downloader in self.downloaders:
+            self.media_queue.put(None)
+        for downloader in self.downloaders:
+            downloader.join()
+        self.write_queue.put(None)
+
+    def download(self):
+        while True:
+            status = self.media_queue.get()
+            if status is None:
+                return
+            for media in status.entities['media']:
+                try:
+                    media['rawdata'] = self.https.request(
+                        'GET', media['media_url_https']).data
+                except Exception as e:
+                    # add_tweet skips media it has no data for
+                    log.error('Image download failed: %s' % str(e))
+                    media['rawdata'] = None
+            self.write_queue.put(status)
+
+    def running(self):
+        '''
+        False once any stage has stopped, so the caller can shut down
+        rather than fill the queues with tweets nothing will write.
+        '''
+        stopped = [thread.name for thread in self.readers +
+                   [self.dispatcher] + self.downloaders + [self.writer]
+                   if not thread.is_alive()]
+        if len(stopped) > 0:
+            log.error('Pipeline stopped: %s not running.' %
+                      ', '.join(stopped))
+        return len(stopped) == 0
+
+    def write(self):
+        try:
+            self._write()
+        except Exception:
+            log.exception('Pipeline writer failed.')
+            raise
+
+    def _write(self):
+        sessions = PartitionedSessions(self.parmdata, get_sql_session)
+        done = False
+        while not done:
+            batch = []
+            try:
+                batch.append(self.write_queue.get(timeout=1))
+                while len(batch) < self.batch_size:
+                    batch.append(self.write_queue.get_nowait())
+            except Empty:
+                pass
+            if None in batch:
+                batch.remove(None)
+                done = True
+
+            # a batch can straddle partitions
+            byperiod = {}
+            for status in batch:
+                byperiod.setdefault(sessions.period(status.created_at),
+                                    []).append(status)
+            for statuses in byperiod.values():
+                session = None
+                try:
+                    # opening a partition touches the database too
+                    session = sessions.get(statuses[0].created_at)
+                    add_tweets(statuses, session, self.get_images,
+                               self.image_path, self.https)
+                    self.n_tweets += len(statuses)
+                except DroppedTweets as e:
+                    # the rest of the batch was written
+                    self.n_tweets += len(statuses) - len(e.tweets)
+                    self.n_failed += len(e.tweets)
+                except Exception as e:
+                    # e.g. the database went away; drop this batch but keep
+                    # the writer going
+                    log.error('Writing %d tweets failed: %s' %
+                              (len(statuses), str(e)))
+                    self.n_failed += len(statuses)
+                    if session is not None:
+                        session.rollback()
+            self.status_update()
+        sessions.close()
+
+    def status_update(self):
+        '''
+        Method for keeping track of the rate at which the pipeline is
+        writing tweets
+        '''
+        elapsed_time = (dt.now() - self.last_time).total_seconds()
+        if elapsed_time > self.log_interval:
+            log.info("Writing %f tweets/second (%f/sec failed)." %
+                     (self.n_tweets/elapsed_time,
+                      self.n_failed/elapsed_time))
+            log.info("Reporting %d/%d/%d tweets waiting to be dispatched/"
+                     "downloaded/written." %
+                     (self.stream_queue.qsize(), self.media_queue.qsize(),
+                      self.write_queue.qsize()))
+            log_pool_status()
+            self.last_time = dt.now()
+            self.n_tweets = 0
+            self.n_failed = 0
@@ -0,0 +1,129 @@
+from __future__ import division
+NAME = "tweetdb"
+VERSION = "0.1"
+DESCRIPTION = "Twitter streaming API client."
+AUTHOR = "Russell Miller"
+AUTHOR_EMAIL = ""
+URL = "https://github.com/starkshift/tweetdb"
+LICENSE = "MIT"
+
+import tweepy
+import pickle
+import logging
+import requests
+import threading
+from multiprocessing import Process
+from datetime import datetime as dt
+
+# get rootLogger
+log = logging.getLogger("__name__")
+
+
+def get_oauth(parmdata):
+    # authenticate to twitter
+    keys = pickle.load(open(parmdata['files']['twitter_keys'], 'rb'))
+    auth = tweepy.OAuthHandler(keys['ConsumerKey'], keys['ConsumerSecret'])
+    auth.set_access_token(keys['AccessToken'], keys['AccessTokenSecret'])
+    return auth
+
+
+class stream_runner(object):
+    '''
+    Keeps a sample stream connected, feeding self.queue.  Shared by the
+    producer process and the single process pipeline's reader thread.
+    '''
+
+    def run(self):
+        while self.active:
+            try:
+                # set up twitter api
+                self.api = tweepy.API(self.auth)
+                
+                # set up stream listener
+                self.myListener = database_listener(self.api, self.queue,
+                                                    self.parmdata['settings']['log_interval'])
+                
+                self.stream =  tweepy.streaming.Stream(self.auth,
+                                                       self.myListener, timeout=60)
+                log.info("Streaming API connected.  Adding tweets to queue.")
+                self.stream.sample()
+            except requests.packages.urllib3.exceptions.ProtocolError:
+                pass
+            except Exception as e:
+                log.error(str(e))
+                pass
+ 
+    def close(self):
+        log.info("Disconnecting Twitter stream.")
+        self.stream.disconnect()
+        self.active = False
+        self.join()
+
+
+class tweet_producer(stream_runner, Process):
+    def __init__(self, auth, queue, parmdata, name=None):
+        # initialize the thread
+        Process.__init__(self, name=name)
+
+        log.info("Starting new tweet producer.")
+        self.auth = auth
+        self.queue = queue
+        self.parmdata = parmdata
+        self.daemon = True
+        self.active = True
+
+
+class tweet_reader(stream_runner, threading.Thread):
+    def __init__(self, auth, queue, parmdata, name=None):
+        threading.Thread.__init__(self, name=name)
+
+        log.info("Starting new tweet reader.")
+        self.auth = auth
+        self.queue = queue
+        self.parmdata = parmdata
+        self.daemon = True
+        self.active = True
+
+###########################################################
+#         Tweepy Listener Class Definitions
+###########################################################
+
+
+class database_listener(tweepy.StreamListener):
+    '''
+    Takes data received from the streaming API and places it in the
+    queue to be processed by tweet_handlers
+    '''
+
+    def on_status(self, status):
+        self.queue.put(status)
+        self.n_count += 1
+        self.status_update()
+        return True
+ 
+    def on_error(self, status_code):
+        log.info('Got an error with status code: ' + str(status_code))
+        return True  # To continue listening
+ 
+    def on_timeout(self):
+        log.info('Listener timeout.')
+        return True   # To continue listening
+
+    def status_update(self):
+        '''
+        Method for keeping track of the rate at which each tweet producer is
+        feeding the queue
+        '''
+        elapsed_time = (dt.now() - self.last_time).total_seconds()
+        if elapsed_time > self.log_interval:
+            log.info("Producing %f tweets/second." %
+                     (self.n_count/elapsed_time))
+            self.last_time = dt.now()
+            self.n_count = 0
+
+    def __init__(self, api, queue, log_interval):
+        self.api = api
+        self.queue = queue
+        self.n_count = 0
+        self.log_interval = log_interval
+        self.last_time = dt.now()